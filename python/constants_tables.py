@@ -9,6 +9,8 @@
     ----------------------------------------------------
     Martin E. Liza  03/26/2023  Initial version.
 '''
+import types
+import numpy as np
 
 # Gladstone-Dale constants 
 def karl_2003(): #follows SU2 MutationPP format 
@@ -168,3 +170,59 @@ def spectroscopy_constants(molecule='N2'):
         dict_out['r_e'] = 1.20752E-10 
 
     return dict_out #wavenumber units  #[cm^-1]
+
+# Species registry, built once at import time from the tables above. Every
+# constant is a read-only contiguous array indexed by the species ID, missing
+# constants are NaN. Buldakov derivatives are stored as 'polarizability_<key>'
+# and Kerl constants as 'kerl_<key>'
+SPECIES = ('N', 'O', 'NO', 'N2', 'O2', 'N+', 'O+', 'NO+', 'N2+', 'O2+', 'H2',
+           'Air')
+SPECIES_INDEX = types.MappingProxyType({s: i for i, s in enumerate(SPECIES)})
+
+def species_id(species):
+    """Integer ID of a species name (IDs are returned as is), or an array of
+    IDs of a sequence of species"""
+    if isinstance(species, (int, np.integer)):
+        return species
+    if isinstance(species, str):
+        return SPECIES_INDEX[species]
+    return np.array([species_id(s) for s in species], dtype=np.intp)
+
+def has_constants(species, *keys):
+    """True if every constant in keys is defined for species"""
+    index = species_id(species)
+    return not any(np.isnan(REGISTRY[k][index]).any() for k in keys)
+
+def require_constants(species, *keys):
+    """Raises a KeyError naming the constants in keys that are not defined
+    for species"""
+    index = species_id(species)
+    missing = [k for k in keys if np.isnan(REGISTRY[k][index]).any()]
+    if missing:
+        raise KeyError(f'No {", ".join(missing)} in constants_tables for '
+                       f'{species}')
+
+def _build_registry():
+    columns = { }
+    def add_column(key, species, value):
+        if key not in columns:
+            columns[key] = np.full(len(SPECIES), np.nan)
+        columns[key][SPECIES_INDEX[species]] = value
+
+    for species in SPECIES:
+        for key, val in spectroscopy_constants(species).items():
+            add_column(key, species, val)
+        for key, val in polarizability_derivatives(species).items():
+            add_column(f'polarizability_{key}', species, val)
+        for key, val in kerl_interpolation(species).items():
+            add_column(f'kerl_{key}', species, val)
+    for species, val in polarizability().items():
+        add_column('polarizability', species, val) #[m^3]
+    for species, val in karl_2003().items():
+        add_column('gladstone_dale', species, val) #[m3/kg]
+
+    for val in columns.values():
+        val.flags.writeable = False
+    return types.MappingProxyType(columns)
+
+REGISTRY = _build_registry()
@@ -23,6 +23,7 @@ scripts_path   = os.environ.get('SCRIPTS')
 python_scripts = os.path.join(scripts_path, 'Python')
 sys.path.append(python_scripts) 
 import optics
+import quantum
 import helper_functions as helper 
 import aerodynamic_functions as aero
 
@@ -219,6 +220,34 @@ def get_density_dict(data_path : str, f_in : str) -> tuple[dict, object, dict]:
 
     return df_in, density_dict, ion_dict
 
+def get_polarizability_dict(df_in : pd.core.frame.DataFrame,
+                            density_dict : dict,
+                            vibrational_number_max : int = 5,
+                            rotational_number_max : int = 30) -> dict:
+    """
+    Thermally averaged Buldakov polarizability of the diatomic molecules at
+    every time step, vibrational levels at Tv and rotational levels at Tt
+    """
+    polarizability_dict = { }
+    for molecule in ('N2', 'O2'):
+        if molecule not in density_dict:
+            continue
+        # [vibrational, rotational]
+        buldakov_expansion = optics.buldakov_expansion(
+                        np.arange(vibrational_number_max + 1)[:, np.newaxis],
+                        np.arange(rotational_number_max + 1)[np.newaxis, :],
+                        molecule)
+        # [time, vibrational, rotational]
+        distribution_func = quantum.two_temperature_distribution_function(
+                                    df_in['Tt'].to_numpy(),
+                                    df_in['Tv'].to_numpy(), molecule,
+                                    vibrational_number_max,
+                                    rotational_number_max)
+        polarizability_dict[molecule] = quantum.thermal_average(
+                                    distribution_func, buldakov_expansion)
+
+    return polarizability_dict #[m^3]
+
 def get_cut_Thesis():
     cut_dict = { } 
     cut_dict['5H']  = { 'density' : [1E-8, 1E-5], 
@@ -298,20 +327,16 @@ def main():
         df_in, density_dict, ion_dict = get_density_dict(data_path,
                                                         f'{f_in}.csv')
 
-        # Gladstone-Dale constants and index of refraction using heath bath data
-        gd_const = optics.Gladstone_Dale(density_dict)
-        index_refraction = optics.index_of_refraction(density_dict)
+        # Gladstone-Dale constants, mass fractions and index of refraction
+        # using heath bath data (single pass over the densities)
+        (gd_const, mass_fraction,
+         index_refraction) = optics.optical_properties(density_dict)
 
         # Gladstone-Dale constant and index of refraction at sea level
         gd = optics.Gladstone_Dale()
-        tot_density = sum(density_dict.values())[0]
-        # Calculate mass fraction and this works
-        mass_fraction = dict([(key, value[0] / tot_density) for key, value 
-                              in density_dict.items()])
-
         gds = 0.0
         for key in mass_fraction.keys():
-            gds += (gd[key] * mass_fraction[key])
+            gds += (gd[key] * mass_fraction[key][0])
 
         gds_vec = gds * np.ones(np.shape(df_in['time'])) 
 
@@ -0,0 +1,58 @@
+'''
+    Date:   10/18/2026
+    Author: Martin E. Liza
+    File:   import_budget.py
+    Def:    Measures the import time of the numeric modules in a fresh
+            interpreter and checks it against IMPORT_BUDGET. Plotting,
+            debugging and optional packages are loaded lazily (see
+            lazy_imports.py) and must not show up here.
+
+            python import_budget.py
+
+    Author          Date        Revision
+    ----------------------------------------------------
+    Martin E. Liza  10/18/2026  Initial version.
+'''
+import os
+import sys
+import subprocess
+
+# Import time budget [s], best of repeat fresh interpreters. numpy and
+# scipy.constants alone take most of it
+IMPORT_BUDGET = { 'constants_tables' : 0.15,
+                  'table_cache'      : 0.15,
+                  'jit_kernels'      : 0.15,
+                  'quantum'          : 0.40,
+                  'optics'           : 0.40 } #[s]
+
+# Modules that have to stay out of the import of the numeric modules
+LAZY_MODULES = ('matplotlib', 'IPython', 'ambiance', 'molmass', 'numba',
+                'helper_functions', 'aerodynamic_functions')
+
+def import_time(module, repeat=5):
+    """Best import time [s] of module over repeat fresh interpreters, and
+    the lazy modules that were imported with it"""
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            f'import {module}\n'
+            'print(time.perf_counter() - t)\n'
+            f'print(*[m for m in {LAZY_MODULES} if m in sys.modules])')
+    python_path = os.path.dirname(os.path.abspath(__file__))
+    best = float('inf')
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                capture_output=True, text=True,
+                                cwd=python_path).stdout.splitlines()
+        best = min(best, float(output[0]))
+    loaded = output[1].split() if len(output) > 1 else [ ]
+    return (best, loaded)
+
+if __name__ == '__main__':
+    over_budget = False
+    for module, budget in IMPORT_BUDGET.items():
+        (seconds, loaded) = import_time(module)
+        status = 'ok' if seconds <= budget and not loaded else 'FAIL'
+        over_budget |= status == 'FAIL'
+        print(f'{module:18} {seconds:6.3f} s (budget {budget:.2f} s) {status}',
+              *loaded)
+    sys.exit(over_budget)
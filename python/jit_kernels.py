@@ -0,0 +1,144 @@
+'''
+    Date:   10/18/2026
+    Author: Martin E. Liza
+    File:   jit_kernels.py
+    Def:    Optional compiled (numba) kernels for the hot loops of quantum.py
+            and optics.py. The backend is selected per call or with the
+            AEROOPTICS_BACKEND environment variable ('numpy' or 'numba'),
+            and falls back to NumPy when numba is not installed.
+
+    Author          Date        Revision
+    ----------------------------------------------------
+    Martin E. Liza  10/18/2026  Initial version.
+'''
+import os
+import types
+import functools
+import importlib.util
+import constants_tables
+import numpy as np
+
+BACKENDS = ('numpy', 'numba')
+
+def get_backend(backend=None):
+    """Returns the backend to use, backend (or AEROOPTICS_BACKEND, defaults
+    to 'numpy'). 'numba' falls back to 'numpy' when numba is not
+    installed"""
+    backend = backend or os.environ.get('AEROOPTICS_BACKEND', 'numpy')
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend}, use one of {BACKENDS}')
+    if backend == 'numba' and importlib.util.find_spec('numba') is None:
+        return 'numpy'
+    return backend
+
+def boltzman_factor_grid(thermal_beta, energy_J, degeneracy, log_flag):
+    """Boltzman factors [thermal_beta.shape + energy_J.shape], degeneracy is
+    broadcast to energy_J"""
+    thermal_beta = np.asarray(thermal_beta, dtype=float)
+    energy_J = np.asarray(energy_J, dtype=float)
+    log_degeneracy = np.log(np.broadcast_to(np.asarray(degeneracy, dtype=float),
+                                            energy_J.shape))
+    out = np.empty((thermal_beta.size, energy_J.size))
+    _kernels().boltzman_factor(thermal_beta.ravel(), energy_J.ravel(),
+                               log_degeneracy.ravel(), log_flag, out)
+    return out.reshape(thermal_beta.shape + energy_J.shape)
+
+def born_oppenheimer_approximation(vibrational_number, rotational_number,
+                                   molecule):
+    """Born-Oppenheimer energy [cm^-1] of broadcast (v, J) arrays, molecule
+    is a species name or ID"""
+    spectroscopy_constants = constants_tables.REGISTRY
+    index = constants_tables.species_id(molecule)
+    (vibrational_number,
+     rotational_number) = np.broadcast_arrays(
+                            np.asarray(vibrational_number, dtype=float),
+                            np.asarray(rotational_number, dtype=float))
+    out = np.empty(vibrational_number.size)
+    _kernels().born_oppenheimer(vibrational_number.ravel(),
+                                rotational_number.ravel(),
+                                spectroscopy_constants['omega_e'][index],
+                                spectroscopy_constants['omega_xe'][index],
+                                spectroscopy_constants['B_e'][index],
+                                spectroscopy_constants['D_e'][index],
+                                spectroscopy_constants['alpha_e'][index], out)
+    return out.reshape(vibrational_number.shape)
+
+def buldakov_expansion(vibrational_degeneracy, rotational_degeneracy,
+                       coefficients):
+    """Buldakov polynomial [molecule, ...] of broadcast x = 2v + 1 and
+    y = J(J + 1) arrays, coefficients is [molecule, 5]"""
+    (vibrational_degeneracy,
+     rotational_degeneracy) = np.broadcast_arrays(
+                                np.asarray(vibrational_degeneracy, dtype=float),
+                                np.asarray(rotational_degeneracy, dtype=float))
+    coefficients = np.atleast_2d(np.asarray(coefficients, dtype=float))
+    out = np.empty((coefficients.shape[0], vibrational_degeneracy.size))
+    _kernels().buldakov(vibrational_degeneracy.ravel(),
+                        rotational_degeneracy.ravel(), coefficients, out)
+    return out.reshape(coefficients.shape[:1] + vibrational_degeneracy.shape)
+
+def index_of_refraction(coefficients, density_matrix, dielectric_const_0):
+    """Dilute and dense index of a [species, cells] matrix of mass densities,
+    both evaluated in a single pass over the cells"""
+    density_matrix = np.asarray(density_matrix, dtype=float)
+    cells_shape = density_matrix.shape[1:]
+    density_matrix = np.ascontiguousarray(
+                        density_matrix.reshape(density_matrix.shape[0], -1))
+    dilute = np.empty(density_matrix.shape[1])
+    dense = np.empty(density_matrix.shape[1])
+    _kernels().index_of_refraction(np.asarray(coefficients, dtype=float),
+                                   density_matrix, dielectric_const_0, dilute,
+                                   dense)
+    return dilute.reshape(cells_shape), dense.reshape(cells_shape)
+
+
+@functools.lru_cache(maxsize=None)
+def _kernels():
+    # numba is only imported, and the kernels compiled (or loaded from the
+    # on-disk cache), the first time the numba backend is used
+    import numba
+
+    @numba.njit(parallel=True, cache=True)
+    def boltzman_factor(thermal_beta, energy_J, log_degeneracy, log_flag, out):
+        for i in numba.prange(thermal_beta.size):
+            for k in range(energy_J.size):
+                tmp = log_degeneracy[k] - energy_J[k] * thermal_beta[i]
+                out[i, k] = tmp if log_flag else np.exp(tmp)
+
+    @numba.njit(parallel=True, cache=True)
+    def born_oppenheimer(vibrational_number, rotational_number, omega_e,
+                         omega_xe, b_e, d_e, alpha_e, out):
+        for i in numba.prange(vibrational_number.size):
+            vib_levels = vibrational_number[i] + 0.5
+            rot_levels = rotational_number[i] * (rotational_number[i] + 1)
+            harmonic = omega_e * vib_levels + b_e * rot_levels
+            anharmonic = omega_xe * vib_levels**2 + d_e * rot_levels**2
+            interaction = alpha_e * vib_levels * rot_levels
+            out[i] = harmonic - anharmonic - interaction
+
+    @numba.njit(parallel=True, cache=True)
+    def buldakov(vibrational_degeneracy, rotational_degeneracy, coefficients,
+                 out):
+        for i in numba.prange(vibrational_degeneracy.size):
+            x = vibrational_degeneracy[i]
+            y = rotational_degeneracy[i]
+            for m in range(coefficients.shape[0]):
+                out[m, i] = (coefficients[m, 0] + coefficients[m, 2] * y +
+                             x * (coefficients[m, 1] + coefficients[m, 3] * x +
+                                  coefficients[m, 4] * y))
+
+    @numba.njit(parallel=True, cache=True)
+    def index_of_refraction(coefficients, density_matrix, dielectric_const_0,
+                            dilute, dense):
+        for i in numba.prange(density_matrix.shape[1]):
+            temp = 0.0
+            for s in range(density_matrix.shape[0]):
+                temp += coefficients[s] * density_matrix[s, i]
+            dilute[i] = 1 + temp / (2 * dielectric_const_0)
+            n_temp = temp / (3 * dielectric_const_0)
+            dense[i] = ((2 * n_temp + 1) / (1 - n_temp))**0.5
+
+    return types.SimpleNamespace(boltzman_factor=boltzman_factor,
+                                 born_oppenheimer=born_oppenheimer,
+                                 buldakov=buldakov,
+                                 index_of_refraction=index_of_refraction)
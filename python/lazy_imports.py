@@ -0,0 +1,55 @@
+'''
+    Date:   10/18/2026
+    Author: Martin E. Liza
+    File:   lazy_imports.py
+    Def:    Modules that are only imported the first time one of their
+            attributes is used, so plotting, debugging and optional packages
+            do not slow down the import of the numeric modules.
+
+    Author          Date        Revision
+    ----------------------------------------------------
+    Martin E. Liza  10/18/2026  Initial version.
+'''
+import os
+import sys
+import types
+import importlib
+
+class LazyModule(types.ModuleType):
+    """Stands in for module name until one of its attributes is accessed.
+    scripts_flag adds $SCRIPTS/Python (helper_functions,
+    aerodynamic_functions) to sys.path before importing"""
+    def __init__(self, name, scripts_flag=False):
+        super().__init__(name)
+        self.__dict__['_scripts_flag'] = scripts_flag
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def _load(self):
+        if self._module is None:
+            if self._scripts_flag:
+                add_scripts_path()
+            self.__dict__['_module'] = importlib.import_module(self.__name__)
+        return self._module
+
+def lazy_import(name, scripts_flag=False):
+    """Returns module name if it is already imported, otherwise a LazyModule
+    that imports it on first use"""
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name, scripts_flag)
+
+def add_scripts_path():
+    """Appends $SCRIPTS/Python to sys.path, SCRIPTS is only required by the
+    functions that use the external helper and aerodynamic modules"""
+    scripts_path = os.environ.get('SCRIPTS')
+    if scripts_path is None:
+        return
+    python_scripts = os.path.join(scripts_path, 'Python')
+    if python_scripts not in sys.path:
+        sys.path.append(python_scripts)
@@ -151,25 +151,18 @@ def plot_polarizability_buldakov_surface(**kargs):
 
 def calculate_kerl_polarizability(temperature_K, wavelength_nm,
                                   output_path, fig_config):
-    pol_Kerl_N2 = optics.kerl_polarizability_temperature(
+    # [molecule, wavelength, temperature]
+    (pol_Kerl_N2,
+     pol_Kerl_O2,
+     pol_Kerl_Air) = optics.kerl_polarizability_tensor(
                                         temperature_K=temperature_K,
-                                        molecule='N2',
-                                        wavelength_nm=wavelength_nm)
-
-    pol_Kerl_O2 = optics.kerl_polarizability_temperature(
-                                        temperature_K=temperature_K,
-                                        molecule='O2',
-                                        wavelength_nm=wavelength_nm)
-
-    pol_Kerl_Air = optics.kerl_polarizability_temperature(
-                                        temperature_K=temperature_K,
-                                        molecule='Air',
-                                        wavelength_nm=wavelength_nm)
+                                        molecule=['N2', 'O2', 'Air'],
+                                        wavelength_nm=wavelength_nm)[:, 0]
 
     plot_polarizability_T(temperature_K=temperature_K, kerl_N2=pol_Kerl_N2,
                         kerl_O2=pol_Kerl_O2, kerl_Air=pol_Kerl_Air,
                         fig_config=fig_config, wavelength_nm=wavelength_nm,
-                        output_path)
+                        output_path=output_path)
 
 if __name__ == "__main__":
 
@@ -201,23 +194,23 @@ if __name__ == "__main__":
     partition_function_dict = { }
     buldakov_expansion = { }
 
-    for t in temperature_K:
-        prob_state_dict[t] = np.zeros(vibrational_num_max)
-        partition_function_dict[t] = np.zeros(vibrational_num_max)
-
-    for t in temperature_K:
-        for v in vibrational_number:
-            prob_state_dict[t][v] = optics.probability_of_state(
-                                    temperature_K=int(t),
-                                    vibrational_number=v,
-                                    rotational_number=rotational_num_max,
-                                    molecule=f'{molecule}')
-
-            partition_function_dict[t][v] = optics.partition_function(
-                                    temperature_K=int(t),
-                                    vibrational_number=v,
-                                    rotational_number=rotational_num_max,
-                                    molecule=f'{molecule}')
+    # Boltzman factors and partition functions truncated at every (v, J)
+    # [temperature, vibrational, rotational]
+    temperature_array = np.array(temperature_K, dtype=float)
+    state_table = quantum.energy_table(vibrational_num_max - 1,
+                                       rotational_num_max, molecule)
+    state_factor = quantum.boltzman_factor_grid(temperature_array,
+                                        state_table['born_oppenheimer'],
+                                        state_table['degeneracy'])
+    cumulative_z = quantum.cumulative_partition_function(
+                                    vibrational_num_max - 1,
+                                    rotational_num_max, temperature_array,
+                                    molecule)
+
+    for ti, t in enumerate(temperature_K):
+        partition_function_dict[t] = cumulative_z[ti, :, rotational_num_max]
+        prob_state_dict[t] = (state_factor[ti, :, rotational_num_max] /
+                              cumulative_z[ti, :, rotational_num_max])
 
     plot_partition_function_vibrational_T(
                             part_func_dict=partition_function_dict,
@@ -238,11 +231,9 @@ if __name__ == "__main__":
     rotational_number = ['1', '10', '20'] 
     legend_name = f'$J$ = {rotational_number}'
     for j in rotational_number:
-        buldakov_expansion[j] = np.zeros(vibrational_num_max)
-        for v in vibrational_number:
-            # Buldakov Polarizability (function of rotational and vibrational numbers)
-            buldakov_expansion[j][v] = optics.buldakov_expansion(
-                                        vibrational_number=v, 
+        # Buldakov Polarizability (function of rotational and vibrational numbers)
+        buldakov_expansion[j] = optics.buldakov_expansion(
+                                        vibrational_number=vibrational_number,
                                         rotational_number=int(j),
                                         molecule=f'{molecule}')
 
@@ -258,14 +249,11 @@ if __name__ == "__main__":
     vibrational_numbers = np.arange(0, vibrational_num_max)
     rotational_numbers = np.arange(0, rotational_num_max)
     vib_mesh, rot_mesh = np.meshgrid(vibrational_numbers, rotational_numbers)
-    buldakov_expansion_2D = np.zeros([rotational_num_max,
-                                           vibrational_num_max])
     fig_name_out = f'surfacePolBuldakov{molecule}.png'
-    for v in vibrational_numbers:
-        for j in rotational_numbers:
-            buldakov_expansion_2D[j][v] = optics.buldakov_expansion(
-                                        vibrational_number=v, 
-                                        rotational_number=j,
+    # [rotational, vibrational]
+    buldakov_expansion_2D = optics.buldakov_expansion(
+                                        vibrational_number=vib_mesh,
+                                        rotational_number=rot_mesh,
                                         molecule=f'{molecule}')
 
     plot_polarizability_buldakov_surface(x_mesh=vib_mesh,
@@ -280,21 +268,22 @@ if __name__ == "__main__":
     temperature_K_max = 2000
     vibrational_number = np.arange(0, vibrational_num_max)
     temperature_K = np.arange(100, 2550, 50)
-    buldakov_expectation_value = np.zeros([vibrational_num_max])
 
-    prob_state = np.zeros([vibrational_num_max, np.shape(temperature_K)[0]])
     vib_mesh, temp_mesh = np.meshgrid(temperature_K, vibrational_number)
-    for v in vibrational_numbers: 
-        buldakov_expectation_value[v] = optics.buldakov_expansion(
-                                        vibrational_number=v, 
+    buldakov_expectation_value = optics.buldakov_expansion(
+                                        vibrational_number=vibrational_numbers,
                                         rotational_number=rotational_num_max,
                                         molecule=f'{molecule}')
-        for indx, val in enumerate(temperature_K):
-            prob_state[v][indx] = optics.probability_of_state(
-                                    temperature_K=val,
-                                    vibrational_number=v,
-                                    rotational_number=rotational_num_max,
-                                    molecule=f'{molecule}')
+
+    # [vibrational, temperature]
+    state_factor = quantum.boltzman_factor_grid(temperature_K,
+                            state_table['born_oppenheimer'][:, -1],
+                            state_table['degeneracy'][-1])
+    cumulative_z = quantum.cumulative_partition_function(
+                                    vibrational_num_max - 1,
+                                    rotational_num_max, temperature_K,
+                                    molecule)[:, :, -1]
+    prob_state = (state_factor / cumulative_z).transpose()
     np.expand_dims(buldakov_expectation_value,1)
     tot_pol = prob_state.transpose() * buldakov_expectation_value
 
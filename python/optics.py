@@ -10,61 +10,158 @@
     Martin E. Liza  03/26/2023  Initial version.
 '''
 import pickle
-import molmass
 import os 
 import sys 
-import IPython
+import functools
+import concurrent.futures
 import constants_tables 
+import table_cache
+import jit_kernels
 import numpy as np
-import matplotlib.pyplot as plt 
 import scipy.constants as s_consts 
-from ambiance import Atmosphere #package for atmosphere properties 
+from lazy_imports import lazy_import
+
+# Imported on first use
+molmass = lazy_import('molmass')
+IPython = lazy_import('IPython')
+plt = lazy_import('matplotlib.pyplot')
+ambiance = lazy_import('ambiance') #package for atmosphere properties 
 
 # My Packages 
-scripts_path   = os.environ.get('SCRIPTS')
-python_scripts = os.path.join(scripts_path, 'Python')
-sys.path.append(python_scripts) 
-import helper_functions as helper 
-import aerodynamic_functions as aero
+helper = lazy_import('helper_functions', scripts_flag=True)
+aero = lazy_import('aerodynamic_functions', scripts_flag=True)
 import quantum
 
-def gas_density(density_dict): # density_dict [kg/m^3]
+def gas_density(density_dict, dtype=None): # density_dict [kg/m^3]
     gas_amu_weight  = aero.air_atomic_mass()  # [g/mol]  
     avogadro_number = s_consts.N_A               # [particles/mol]  
     gas_density     = { }
     
     for i in density_dict: 
+        if dtype is not None:
+            # Particles per kilogram are formed in float64 before casting
+            gas_density[i] = (np.asarray(density_dict[i], dtype=dtype) *
+                              np.dtype(dtype).type(10**3 * avogadro_number /
+                                                   gas_amu_weight[i]))
+            continue
         gas_density[i] = (density_dict[i] * 10**3 * 
                                avogadro_number /
                                gas_amu_weight[i]) # [particles/m^3] 
 
     return gas_density #[particles/m^3] 
 
-def index_of_refraction(gas_density_dict):
-    pol_consts         = constants_tables.polarizability() # [m^3] 
-    dielectric_const_0 = s_consts.epsilon_0                # [F/m] 
-    density            = gas_density(gas_density_dict)     # [particles/m3]    
-    n_const            = { }                               # [ ] 
-    # Convert cgs to SI
-    alpha_si = lambda x : x * (4 * np.pi * dielectric_const_0) #[F m2]
+def index_of_refraction(gas_density_dict, refractivity_flag=False,
+                        dtype=None):
+    """Dilute and dense index of refraction of a dictionary of species
+    densities [kg/m^3] read in dtype. refractivity_flag returns n - 1
+    computed directly (see refractivity_matrix), which keeps ~1e-7 relative
+    accuracy with dtype=np.float32. The index itself is always float64, in
+    float32 adding 1 would lose most of n - 1"""
+    species = tuple(gas_density_dict.keys())
+    density_matrix = species_density_matrix(gas_density_dict, species,
+                                            dtype or float)
+    if refractivity_flag:
+        return refractivity_matrix(density_matrix, species)
+    return index_of_refraction_matrix(density_matrix, species)
+
+def species_density_matrix(density_dict, species=None, dtype=float):
+    """Stacks a dictionary of species densities into a [species, cells]
+    matrix, rows follow species (defaults to the dictionary order)"""
+    species = species or tuple(density_dict.keys())
+    return np.stack([np.asarray(density_dict[i], dtype=dtype)
+                     for i in species])
+
+def gas_density_matrix(density_matrix, species):
+    """Number densities [particles/m^3] of a [species, cells] matrix of
+    mass densities [kg/m^3]"""
+    number_density = molar_number_density(tuple(species))
+    return density_matrix * number_density.reshape(
+                                (-1,) + (1,) * (np.ndim(density_matrix) - 1))
 
-    for i in gas_density_dict: 
-        # Convert alpha_cgs to alpha_si 
-        alpha      = alpha_si(pol_consts[i]) 
-        n_const[i] = (alpha * density[i]) #(a_i N_i)
+def index_of_refraction_matrix(density_matrix, species, backend=None):
+    """Dilute and dense index of refraction of a [species, cells] matrix of
+    mass densities [kg/m^3], the sum of a_i N_i is a single matrix-vector
+    product with the precomputed refractivity_coefficients"""
+    dielectric_const_0 = s_consts.epsilon_0                     # [F/m]
+    coefficients = refractivity_coefficients(tuple(species))    # [F m^2/kg]
+    if jit_kernels.get_backend(backend) == 'numba':
+        n_return = { }
+        (n_return['dilute'],
+         n_return['dense']) = jit_kernels.index_of_refraction(
+                                coefficients, density_matrix,
+                                dielectric_const_0)
+        return n_return
+
+    temp = np.tensordot(coefficients, density_matrix, axes=1)   # sum(a_i N_i)
+
+    n_return = { }
+    n_return['dilute'] = 1 + temp / (2 * dielectric_const_0)
+    n_return['dense']  = _dense_index(temp / (3 * dielectric_const_0))
+    # Note np.sqrt(-1) does not detect complex
 
-    # add all n_i 
-    temp = 0.0
-    for i in n_const.values():
-        temp += i 
+    return n_return
 
+def refractivity_matrix(density_matrix, species):
+    """Dilute and dense refractivity n - 1 of a [species, cells] matrix of
+    mass densities [kg/m^3], computed in the precision of density_matrix.
+    n - 1 = sum(GD_i rho_i) is formed directly and the dense (Lorentz-Lorenz)
+    value uses log1p/expm1, so 1 is never added and subtracted"""
+    dtype = density_matrix.dtype
+    gd_consts = gladstone_dale_coefficients(tuple(species)).astype(dtype)
     n_return = { }
-    n_return['dilute'] = 1 + temp / (2 * dielectric_const_0) 
-    n_temp             = temp / (3 * dielectric_const_0)
-    n_return['dense']  = ( (2 * n_temp + 1) / (1 - n_temp) )**0.5
-    # Note np.sqrt(-1) does not detect complex 
+    n_return['dilute'] = np.tensordot(gd_consts, density_matrix, axes=1)
+    n_return['dense'] = _dense_refractivity(n_return['dilute'] *
+                                            dtype.type(2/3))
+    return n_return
 
-    return n_return 
+def precision_error(gas_density_dict, dtype=np.float32):
+    """Worst-case relative error of the number densities, refractivities
+    (n - 1) and Gladstone-Dale constants computed in dtype, against the
+    float64 path"""
+    def max_error(value, reference):
+        return float(np.max(np.abs(np.asarray(value, dtype=float) /
+                                   reference - 1)))
+
+    error = { }
+    reference = gas_density(gas_density_dict)
+    value = gas_density(gas_density_dict, dtype)
+    error['gas_density'] = max(max_error(value[i], reference[i])
+                               for i in reference)
+
+    reference = index_of_refraction(gas_density_dict, refractivity_flag=True)
+    value = index_of_refraction(gas_density_dict, refractivity_flag=True,
+                                dtype=dtype)
+    for key in ('dilute', 'dense'):
+        error[f'refractivity_{key}'] = max_error(value[key], reference[key])
+
+    reference = Gladstone_Dale(gas_density_dict)
+    value = Gladstone_Dale(gas_density_dict, dtype)
+    error['gladstone_dale'] = max_error(value['gladstone_dale'],
+                                        reference['gladstone_dale'])
+    return error
+
+@functools.lru_cache(maxsize=None)
+def molar_number_density(species):
+    """Particles per kilogram [particles/kg] of every species (tuple)"""
+    gas_amu_weight  = aero.air_atomic_mass()  # [g/mol]
+    avogadro_number = s_consts.N_A            # [particles/mol]
+    number_density = np.array([10**3 * avogadro_number / gas_amu_weight[i]
+                               for i in species])
+    number_density.flags.writeable = False
+    return number_density #[particles/kg]
+
+@functools.lru_cache(maxsize=None)
+def refractivity_coefficients(species):
+    """SI polarizability times particles per kilogram of every species
+    (tuple), a_i N_i = coefficient_i rho_i [F m^2/kg]"""
+    pol_consts         = constants_tables.REGISTRY['polarizability'] # [m^3]
+    dielectric_const_0 = s_consts.epsilon_0                # [F/m]
+    # Convert cgs to SI
+    alpha_si = pol_consts[constants_tables.species_id(species)] * (4 * np.pi *
+                                            dielectric_const_0) #[F m2]
+    coefficients = alpha_si * molar_number_density(species)
+    coefficients.flags.writeable = False
+    return coefficients
 
 def dielectric_material_const(n_const): 
     # n ~ sqrt(e_r)  
@@ -88,69 +185,110 @@ def tropina_aproximation(vibrational_number, rotational_number, molecule):
 
 
 # Calculate polarizability (uses equation 4 from the paper)
-def buldakov_expansion(vibrational_number, rotational_number, molecule):
+def buldakov_expansion(vibrational_number, rotational_number, molecule,
+                       backend=None):
+    """Polarizability [m^3] of the (v, J) states. vibrational_number and
+    rotational_number are broadcast against each other, molecule can be a
+    list which adds a leading molecule axis to the output"""
+    vibrational_number = np.asarray(vibrational_number, dtype=float)
+    rotational_number = np.asarray(rotational_number, dtype=float)
+    rotational_degeneracy = rotational_number * (rotational_number + 1)
+    vibrational_degeneracy = 2 * vibrational_number + 1
+
+    if isinstance(molecule, str):
+        coefficients = np.array(buldakov_coefficients(molecule))
+    else:
+        coefficients = np.array([buldakov_coefficients(m) for m in molecule])
+
+    if jit_kernels.get_backend(backend) == 'numba':
+        polarizability = jit_kernels.buldakov_expansion(
+                            vibrational_degeneracy, rotational_degeneracy,
+                            coefficients)
+        if isinstance(molecule, str):
+            return polarizability[0]
+        return polarizability
+
+    # [coefficient, molecule, ...]
+    coefficients = coefficients.transpose()
+    coefficients = coefficients.reshape(coefficients.shape +
+                                        (1,) * max(vibrational_degeneracy.ndim,
+                                                   rotational_degeneracy.ndim))
+    (zeroth, vib, rot, vib_vib, vib_rot) = coefficients
+
+    return (zeroth + rot * rotational_degeneracy +
+            vibrational_degeneracy * (vib + vib_vib * vibrational_degeneracy +
+                                      vib_rot * rotational_degeneracy))
+
+# Polarizability derivatives of the Buldakov expansion
+BULDAKOV_DERIVATIVES = ('zeroth', 'first', 'second', 'third')
+
+@functools.lru_cache(maxsize=None)
+def buldakov_coefficients(molecule):
+    """Coefficients of the Buldakov expansion as a polynomial in
+    x = 2v + 1 and y = J(J + 1), alpha = zeroth + c_x x + c_y y + c_xx x^2 +
+    c_xy x y. Returns (zeroth, c_x, c_y, c_xx, c_xy) [m^3]"""
+    constants_tables.require_constants(molecule, *[f'polarizability_{k}'
+                                                   for k in BULDAKOV_DERIVATIVES])
+    registry = constants_tables.REGISTRY
+    index = constants_tables.species_id(molecule)
+    derivative_const = {k: registry[f'polarizability_{k}'][index]
+                        for k in BULDAKOV_DERIVATIVES}
+    return _buldakov_coefficients(molecule, derivative_const)
+
+@functools.lru_cache(maxsize=None)
+def buldakov_basis(molecule):
+    """The Buldakov coefficients are linear in the polarizability
+    derivatives, row k holds the coefficients for a unit
+    BULDAKOV_DERIVATIVES[k] [derivative, coefficient]"""
+    basis = np.array([_buldakov_coefficients(molecule,
+                            {k: float(k == i) for k in BULDAKOV_DERIVATIVES})
+                      for i in BULDAKOV_DERIVATIVES])
+    basis.flags.writeable = False
+    return basis
+
+def _buldakov_coefficients(molecule, derivative_const):
     # Load constants
-    spectroscopy_const = constants_tables.spectroscopy_constants(molecule)
-    derivative_const = constants_tables.polarizability_derivatives(molecule)
-    be_we = spectroscopy_const['B_e'] / spectroscopy_const['omega_e']
+    constants_tables.require_constants(molecule, 'B_e', 'omega_e')
+    registry = constants_tables.REGISTRY
+    index = constants_tables.species_id(molecule)
+    be_we = registry['B_e'][index] / registry['omega_e'][index]
 
     # Dunham potential energy constants
     (a_0, a_1, a_2) = quantum.potential_dunham_coef_012(molecule)
     a_3 = quantum.potential_dunham_coeff_m(a_1, a_2, 3)
 
-    rotational_degeneracy = rotational_number * (rotational_number + 1)
-    vibrational_degeneracy = 2 * vibrational_number + 1
+    # Split in terms, [constant, x^2] parts of the terms quadratic in x
+    quadratic_7_15 = np.array([7, 15])
+    quadratic_23_39 = np.array([23, 39])
+    quadratic_5_1 = np.array([5, 1])
 
-    # Split in terms
+    # Term proportional to x
     tmp_1 = be_we
     tmp_1 *= (-3 * a_1 * derivative_const['first'] +
              derivative_const['second'])
-    tmp_1 *= vibrational_degeneracy 
     tmp_1 *= 1/2
 
+    # Term proportional to y
     tmp_2 = be_we**2
     tmp_2 *= derivative_const['first']
-    tmp_2 *= rotational_degeneracy
     tmp_2 *= 4
 
-    tmp_31a = 7
-    tmp_31a += (15 * vibrational_degeneracy**2) 
-    tmp_31a *= a_1**3
-    tmp_31a *= -3/8
-
-    tmp_31b = 23
-    tmp_31b += (39 * vibrational_degeneracy**2) 
-    tmp_31b *= a_2
-    tmp_31b *= a_1
-    tmp_31b *=  1/4
-
-    tmp_31c = 5
-    tmp_31c += vibrational_degeneracy**2 
-    tmp_31c *= a_3
-    tmp_31c *= -15/4
-
+    tmp_31a = quadratic_7_15 * a_1**3 * -3/8
+    tmp_31b = quadratic_23_39 * a_2 * a_1 * 1/4
+    tmp_31c = quadratic_5_1 * a_3 * -15/4
     tmp_31 = derivative_const['first'] * (tmp_31a + tmp_31b + tmp_31c)
 
-    tmp_32a = 7
-    tmp_32a += (15 * vibrational_degeneracy**2)
-    tmp_32a *= a_1**2
-    tmp_32a *= 1/8
-
-    tmp_32b = 5
-    tmp_32b += vibrational_degeneracy**2
-    tmp_32b *= a_2
-    tmp_32b *- -3/4
-
+    tmp_32a = quadratic_7_15 * a_1**2 * 1/8
+    # The -3/4 factor of this term was never applied (a '*-' typo in the
+    # original expression), kept as is so results do not change
+    tmp_32b = quadratic_5_1 * a_2
     tmp_32 = derivative_const['second'] * (tmp_32a + tmp_32b)
 
-    tmp_33 = 7
-    tmp_33 += (15 * vibrational_degeneracy**2)
-    tmp_33 *= a_1
-    tmp_33 *= derivative_const['third']
-    tmp_33 *= -1/24
+    tmp_33 = quadratic_7_15 * a_1 * derivative_const['third'] * -1/24
 
     tmp_3 = (tmp_31 + tmp_32 + tmp_33) * be_we**2
 
+    # Term proportional to x y
     tmp_41 = 1 - a_2
     tmp_41 *= 24
     tmp_41 += (27 * a_1 * (1 + a_1))
@@ -162,13 +300,233 @@ def buldakov_expansion(vibrational_number, rotational_number, molecule):
 
     tmp_43 = 1/8 * derivative_const['third']
 
-    tmp_4 = (tmp_41 + tmp_42 + tmp_43) 
-    tmp_4 *= rotational_degeneracy
-    tmp_4 *= vibrational_degeneracy
+    tmp_4 = (tmp_41 + tmp_42 + tmp_43)
     tmp_4 *= be_we**3
 
-    return derivative_const['zeroth'] + tmp_1 + tmp_2 + tmp_3 + tmp_4
+    return (derivative_const['zeroth'] + tmp_3[0], tmp_1, tmp_2, tmp_3[1],
+            tmp_4)
+
+
+def buldakov_polarizability_temperature(temperature_K, molecule,
+                                        vibrational_number_max,
+                                        rotational_number_max,
+                                        temperature_range=(100, 20000),
+                                        tolerance=1E-6, cache_path=None):
+    """Thermally averaged Buldakov polarizability [m^3], interpolated from a
+    log-spaced temperature table built once per (molecule,
+    vibrational_number_max, rotational_number_max) and kept by table_cache
+    (LRU, optionally on disk). The relative interpolation error is below
+    tolerance inside temperature_range, temperatures outside it are
+    evaluated directly"""
+    (table, thermal_polarizability) = _buldakov_table(molecule,
+                                            vibrational_number_max,
+                                            rotational_number_max,
+                                            temperature_range, tolerance,
+                                            cache_path)
+    return table_cache.interpolate_table(table, temperature_K,
+                                    thermal_polarizability)['polarizability']
+
+def buldakov_basis_temperature(temperature_K, molecule,
+                               vibrational_number_max, rotational_number_max,
+                               temperature_range=(100, 20000), tolerance=1E-6,
+                               cache_path=None):
+    """Thermal averages of the buldakov_basis polynomials [..., derivative],
+    the thermally averaged polarizability is their product with the
+    polarizability derivatives (BULDAKOV_DERIVATIVES) [m^3]"""
+    basis = buldakov_basis(molecule)
+    vib_degeneracy = 2 * np.arange(vibrational_number_max + 1) + 1
+    rot_degeneracy = np.arange(rotational_number_max + 1)
+    rot_degeneracy = rot_degeneracy * (rot_degeneracy + 1)
+    # [derivative, vibrational, rotational]
+    basis_grid = np.array([
+        k[0] + k[2] * rot_degeneracy[np.newaxis, :] +
+        vib_degeneracy[:, np.newaxis] * (k[1] +
+                                         k[3] * vib_degeneracy[:, np.newaxis] +
+                                         k[4] * rot_degeneracy[np.newaxis, :])
+        for k in basis])
+
+    def thermal_basis(temperature):
+        distribution_func = quantum.distribution_function(temperature,
+                                molecule, vibrational_number_max,
+                                rotational_number_max, born_opp_flag=True)
+        return {f'basis_{i}': quantum.thermal_average(distribution_func, val)
+                for i, val in enumerate(basis_grid)}
+
+    builder = lambda: table_cache.build_table(thermal_basis,
+                                              *temperature_range,
+                                              tolerance=tolerance)
+    key = ('buldakov_basis', molecule, vibrational_number_max,
+           rotational_number_max, *temperature_range, tolerance)
+    table = table_cache.cached_table(key, builder, cache_path)
+    columns = table_cache.interpolate_table(table, temperature_K,
+                                            thermal_basis)
+    return np.stack([columns[f'basis_{i}'] for i in range(len(basis))],
+                    axis=-1)
+
+def build_buldakov_tables(vibrational_number_max, rotational_number_max,
+                          temperature_range=(100, 20000), tolerance=1E-6,
+                          cache_path=None):
+    """Builds (or loads) the thermally averaged Buldakov table of every
+    molecule of constants_tables with polarizability derivatives and
+    spectroscopy constants"""
+    tables = { }
+    for molecule in constants_tables.SPECIES:
+        if not constants_tables.has_constants(molecule, 'polarizability_first',
+                                              'omega_e'):
+            continue
+        (tables[molecule], _) = _buldakov_table(molecule,
+                                                vibrational_number_max,
+                                                rotational_number_max,
+                                                temperature_range, tolerance,
+                                                cache_path)
+    return tables
+
+def _buldakov_table(molecule, vibrational_number_max, rotational_number_max,
+                    temperature_range, tolerance, cache_path):
+    # Returns the table and the function it tabulates
+    # [vibrational, rotational]
+    buldakov_grid = buldakov_expansion(
+                        np.arange(vibrational_number_max + 1)[:, np.newaxis],
+                        np.arange(rotational_number_max + 1)[np.newaxis, :],
+                        molecule)
+
+    def thermal_polarizability(temperature):
+        # [temperature, vibrational, rotational]
+        distribution_func = quantum.distribution_function(temperature,
+                                molecule, vibrational_number_max,
+                                rotational_number_max, born_opp_flag=True)
+        return {'polarizability': quantum.thermal_average(distribution_func,
+                                                          buldakov_grid)}
+
+    builder = lambda: table_cache.build_table(thermal_polarizability,
+                                              *temperature_range,
+                                              tolerance=tolerance)
+    key = ('buldakov_polarizability', molecule, vibrational_number_max,
+           rotational_number_max, *temperature_range, tolerance)
+    return (table_cache.cached_table(key, builder, cache_path),
+            thermal_polarizability)
 
+def buldakov_two_temperature_polarizability(translational_temperature_K,
+                                            vibrational_temperature_K,
+                                            molecule, vibrational_number_max,
+                                            rotational_number_max,
+                                            temperature_range=(100, 20000),
+                                            tolerance=1E-6, cache_path=None):
+    """Buldakov polarizability [m^3] averaged over the two-temperature
+    (Tt, Tv) distribution of quantum.two_temperature_distribution_function.
+    The rotational sums of every vibrational level only depend on Tt and are
+    interpolated from a cached table, the vibrational levels are summed at
+    Tv per cell. Tt outside temperature_range is evaluated directly"""
+    (table, rotational_polarizability) = _buldakov_rotational_table(
+                                            molecule, vibrational_number_max,
+                                            rotational_number_max,
+                                            temperature_range, tolerance,
+                                            cache_path)
+    (temperature_t, temperature_v) = np.broadcast_arrays(
+                                np.asarray(translational_temperature_K,
+                                           dtype=float),
+                                np.asarray(vibrational_temperature_K,
+                                           dtype=float))
+    columns = table_cache.interpolate_table(table, temperature_t,
+                                            rotational_polarizability)
+    vib_levels = range(vibrational_number_max + 1)
+    # [..., vibrational]
+    rotational_sum = np.stack([columns[f'partition_{v}'] for v in vib_levels],
+                              axis=-1)
+    polarizability = np.stack([columns[f'polarizability_{v}']
+                               for v in vib_levels], axis=-1)
+
+    energy_vib = quantum.energy_table(vibrational_number_max,
+                                      rotational_number_max,
+                                      molecule)['born_oppenheimer'][:, 0] #[J]
+    log_vib = quantum.boltzman_factor_grid(temperature_v,
+                                           energy_vib - energy_vib[0],
+                                           log_flag=True)
+    weight = np.exp(log_vib) * rotational_sum
+    return (np.sum(weight * polarizability, axis=-1) /
+            np.sum(weight, axis=-1)) #[m^3]
+
+def _buldakov_rotational_table(molecule, vibrational_number_max,
+                               rotational_number_max, temperature_range,
+                               tolerance, cache_path):
+    # Rotational partition function and rotationally averaged polarizability
+    # of every vibrational level, rotational energy E(v, J) - E(v, 0).
+    # Returns the table and the function it tabulates
+    buldakov_grid = buldakov_expansion(
+                        np.arange(vibrational_number_max + 1)[:, np.newaxis],
+                        np.arange(rotational_number_max + 1)[np.newaxis, :],
+                        molecule)
+    table = quantum.energy_table(vibrational_number_max, rotational_number_max,
+                                 molecule)
+    energy_rot = (table['born_oppenheimer'] -
+                  table['born_oppenheimer'][:, :1]) #[J]
+
+    def rotational_polarizability(temperature):
+        # [temperature, vibrational, rotational]
+        factor = quantum.boltzman_factor_grid(temperature, energy_rot,
+                                              table['degeneracy'])
+        rotational_sum = np.sum(factor, axis=-1)
+        average = np.sum(factor * buldakov_grid, axis=-1) / rotational_sum
+        dict_out = { }
+        for v in range(vibrational_number_max + 1):
+            dict_out[f'partition_{v}'] = rotational_sum[..., v]
+            dict_out[f'polarizability_{v}'] = average[..., v]
+        return dict_out
+
+    builder = lambda: table_cache.build_table(rotational_polarizability,
+                                              *temperature_range,
+                                              tolerance=tolerance)
+    key = ('buldakov_rotational', molecule, vibrational_number_max,
+           rotational_number_max, *temperature_range, tolerance)
+    return (table_cache.cached_table(key, builder, cache_path),
+            rotational_polarizability)
+
+def polarizability_field(species, temperature_K, vibrational_temperature_K=None,
+                         model='buldakov', wavelength_nm=None,
+                         vibrational_number_max=5, rotational_number_max=30,
+                         temperature_range=(100, 20000), tolerance=1E-6,
+                         cache_path=None):
+    """Temperature dependent polarizability [m^3] of every species at every
+    cell [species, cells]. model is 'kerl' (at temperature_K and
+    wavelength_nm, static when None) or 'buldakov' (cached tables, two
+    temperature when vibrational_temperature_K is given). Species without
+    the model constants keep their constant polarizability"""
+    if model not in ('kerl', 'buldakov'):
+        raise ValueError(f"Unknown model {model}, use 'kerl' or 'buldakov'")
+    temperature_K = np.asarray(temperature_K, dtype=float)
+    if wavelength_nm is None:
+        wavelength_nm = np.inf
+    pol_consts = constants_tables.REGISTRY['polarizability'] #[m^3]
+
+    polarizability = np.empty((len(species),) + temperature_K.shape)
+    for i, molecule in enumerate(species):
+        if (model == 'kerl' and
+                constants_tables.has_constants(molecule, 'kerl_b')):
+            polarizability[i] = kerl_polarizability_temperature(
+                                    temperature_K, molecule, wavelength_nm)
+        elif (model == 'buldakov' and
+                constants_tables.has_constants(molecule,
+                                               'polarizability_first',
+                                               'omega_e')):
+            if vibrational_temperature_K is None:
+                polarizability[i] = buldakov_polarizability_temperature(
+                                        temperature_K, molecule,
+                                        vibrational_number_max,
+                                        rotational_number_max,
+                                        temperature_range, tolerance,
+                                        cache_path)
+            else:
+                polarizability[i] = buldakov_two_temperature_polarizability(
+                                        temperature_K,
+                                        vibrational_temperature_K, molecule,
+                                        vibrational_number_max,
+                                        rotational_number_max,
+                                        temperature_range, tolerance,
+                                        cache_path)
+        else:
+            polarizability[i] = pol_consts[
+                                    constants_tables.species_id(molecule)]
+    return polarizability #[m^3]
 
 # Calculate polarizability as temperature
 """
@@ -186,26 +544,73 @@ def kerl_polarizability_temperature(*args, **kargs):
         molecule = kargs['molecule']
         wavelength_nm = kargs['wavelength_nm']
 
-    # Check sizes
-    mean_const = constants_tables.kerl_interpolation(molecule)
+    # temperature_K and wavelength_nm are broadcast against each other, a list
+    # of molecules adds a leading molecule axis
+    temperature_K = np.asarray(temperature_K, dtype=float)
+    wavelength_nm = np.asarray(wavelength_nm, dtype=float)
+    registry = constants_tables.REGISTRY
+    index = constants_tables.species_id(molecule)
+    shape = np.shape(index) + (1,) * max(temperature_K.ndim,
+                                         wavelength_nm.ndim)
+    mean_const = {k: np.reshape(registry[f'kerl_{k}'][index], shape)
+                  for k in ('groundPolarizability', 'groundFrequency', 'b', 'c')}
     angular_frequency = (2 * np.pi * s_consts.speed_of_light /
                          (wavelength_nm * 1E-9))
 
     tmp = mean_const['c'] * temperature_K**2
-    tmp += mean_const['b'] * temperature_K
+    tmp = tmp + mean_const['b'] * temperature_K
     tmp += 1
     tmp *= mean_const['groundPolarizability']
-    tmp /= (1 - (angular_frequency / mean_const['groundFrequency'])**2)
+    tmp = tmp / (1 - (angular_frequency / mean_const['groundFrequency'])**2)
 
     return tmp
 
+def kerl_polarizability_tensor(temperature_K, molecule, wavelength_nm):
+    """Kerl polarizability [m^3] of every combination of the temperatures,
+    molecules and wavelengths, [molecule, wavelength, temperature]"""
+    if isinstance(molecule, str):
+        molecule = [molecule]
+    return kerl_polarizability_temperature(
+                np.ravel(temperature_K)[np.newaxis, :], molecule,
+                np.ravel(wavelength_nm)[:, np.newaxis])
+
+@functools.lru_cache(maxsize=None)
+def dispersion_factors(species, wavelength_nm):
+    """Kerl single-oscillator dispersion 1 / (1 - (omega / omega_0)^2) of
+    every species (tuple) at every wavelength (tuple) [wavelength, species].
+    Species without a Kerl ground frequency are non-dispersive (factor 1)"""
+    ground_frequency = constants_tables.REGISTRY['kerl_groundFrequency'][
+                            constants_tables.species_id(species)] # [1/s]
+    angular_frequency = (2 * np.pi * s_consts.speed_of_light /
+                         (np.array(wavelength_nm, dtype=float) * 1E-9))
+    factors = 1 / (1 - (angular_frequency[:, np.newaxis] /
+                        ground_frequency[np.newaxis, :])**2)
+    factors[:, np.isnan(ground_frequency)] = 1.0
+    factors.flags.writeable = False
+    return factors
+
+# Refractivity of moist air, (n - 1) 1E6 = K_1 / T (p + K_2 e / T), with the
+# pressure p and the vapor pressure e in mbar
+REFRACTIVITY_K1 = 79   #[K/mbar]
+REFRACTIVITY_K2 = 4800 #[K]
+
 # http://walter.bislins.ch/bloge/index.asp?page=Deriving+Equations+for+Atmospheric+Refraction
-def atmospheric_index_of_refraction(altitude, vaporPressure=0): 
-    atmospheric_prop = Atmosphere(altitude)
+def atmospheric_index_of_refraction(altitude, vaporPressure=0,
+                                    table_flag=True): 
+    """Index of refraction of the standard atmosphere, altitude [m] and
+    vaporPressure [mbar]. table_flag interpolates atmospheric_table (within
+    its relative tolerance) and evaluates altitudes outside ATMOSPHERE_RANGE
+    directly"""
+    if table_flag:
+        refractivity = atmospheric_properties(altitude,
+                                              vaporPressure)['refractivity']
+        return refractivity + 1
+
+    atmospheric_prop = ambiance.Atmosphere(altitude)
     temperature      = atmospheric_prop.temperature #[K]
     pressure         = atmospheric_prop.pressure * 0.01 #[mbar]
-    K_1              = 79 #[K/mbar]
-    K_2              = 4800 #[K]
+    K_1              = REFRACTIVITY_K1 #[K/mbar]
+    K_2              = REFRACTIVITY_K2 #[K]
 
     refractivity =  K_2 * vaporPressure / temperature
     refractivity += pressure
@@ -214,58 +619,626 @@ def atmospheric_index_of_refraction(altitude, vaporPressure=0):
 
     return refractivity + 1 
 
+# Altitudes covered by atmospheric_table [m], the table itself is uniform in
+# geopotential height with 1 km intervals (and halvings of them), so the
+# temperature kinks at the layer boundaries fall on grid points
+ATMOSPHERE_RANGE = (0.0, 81E3)
+GEOPOTENTIAL_RANGE = (0.0, 80E3)
+
+def atmospheric_table(tolerance=1E-5, cache_path=None):
+    """Standard atmosphere table on a uniform geopotential height grid
+    covering ATMOSPHERE_RANGE, built once per process by table_cache
+    (optionally kept on disk). Linear interpolation has a relative error
+    below tolerance for every column (checked at every interval midpoint,
+    stored in 'error'):
+    temperature [K], pressure [Pa], density [kg/m3], dry refractivity
+    (n - 1), vapor refractivity per mbar of vapor pressure [1/mbar] and the
+    effective Gladstone-Dale constant of the dry refractivity [m3/kg].
+    The ambiance pressure jumps by ~1E-6 (relative) at the layer boundaries,
+    tighter tolerances stop at that floor"""
+    def atmospheric_columns(geopotential_altitude):
+        altitude = ambiance.Atmosphere.geop2geom_height(geopotential_altitude)
+        atmospheric_prop = ambiance.Atmosphere(altitude)
+        dict_out = { }
+        dict_out['temperature'] = atmospheric_prop.temperature #[K]
+        dict_out['pressure'] = atmospheric_prop.pressure       #[Pa]
+        dict_out['density'] = atmospheric_prop.density         #[kg/m3]
+        dict_out['refractivity'] = (atmospheric_index_of_refraction(
+                                        altitude, table_flag=False) - 1)
+        dict_out['vapor_refractivity'] = (atmospheric_index_of_refraction(
+                                        altitude, 1, table_flag=False) - 1 -
+                                          dict_out['refractivity']) #[1/mbar]
+        dict_out['gladstone_dale'] = (dict_out['refractivity'] /
+                                      dict_out['density']) #[m3/kg]
+        return dict_out
+
+    builder = lambda: table_cache.build_table(atmospheric_columns,
+                                              *GEOPOTENTIAL_RANGE,
+                                              tolerance=tolerance,
+                                              log_flag=False,
+                                              points=int(GEOPOTENTIAL_RANGE[1] /
+                                                         1E3) + 1)
+    key = ('atmosphere', *GEOPOTENTIAL_RANGE, tolerance)
+    return table_cache.cached_table(key, builder, cache_path)
+
+def atmospheric_properties(altitude, vaporPressure=0, tolerance=1E-5,
+                           cache_path=None):
+    """Vectorized lookup of atmospheric_table at altitude [m], the
+    refractivity includes the vapor pressure [mbar] term and altitudes
+    outside ATMOSPHERE_RANGE are evaluated directly"""
+    altitude = np.asarray(altitude, dtype=float)
+    table = atmospheric_table(tolerance, cache_path)
+    geopotential_altitude = np.reshape(
+                ambiance.Atmosphere.geom2geop_height(altitude), altitude.shape)
+    dict_out = table_cache.interpolate_table(table, geopotential_altitude)
+
+    outside = ((altitude < ATMOSPHERE_RANGE[0]) |
+               (altitude > ATMOSPHERE_RANGE[1]))
+    if np.any(outside):
+        # Columns are at least 1-D so scalar altitudes can be assigned
+        outside = np.atleast_1d(outside)
+        outside_altitude = np.atleast_1d(altitude)[outside]
+        atmospheric_prop = ambiance.Atmosphere(outside_altitude)
+        exact = { }
+        exact['temperature'] = atmospheric_prop.temperature
+        exact['pressure'] = atmospheric_prop.pressure
+        exact['density'] = atmospheric_prop.density
+        exact['refractivity'] = (atmospheric_index_of_refraction(
+                            outside_altitude, table_flag=False) - 1)
+        exact['vapor_refractivity'] = (atmospheric_index_of_refraction(
+                            outside_altitude, 1, table_flag=False) - 1 -
+                                       exact['refractivity'])
+        exact['gladstone_dale'] = exact['refractivity'] / exact['density']
+        for key, val in exact.items():
+            column = np.array(dict_out[key], ndmin=1)
+            column[outside] = val
+            dict_out[key] = column.reshape(altitude.shape)
+
+    dict_out['refractivity'] = (dict_out['refractivity'] + vaporPressure *
+                                dict_out['vapor_refractivity'])
+    return dict_out
+
 def atmospheric_gladstoneDaleConstant(altitude=0.0, gas_composition_dict=None):
-    atmospheric_prop = Atmosphere(altitude)
-    density          = atmospheric_prop.density * 1E3   #[g/m3]
-    num_density      = atmospheric_prop.number_density  #[particles/m3]
-    gladstone_const  = Gladstone_Dale()                 #[m3/kg]
-    avogadro_number  = s_consts.N_A                     #[particles/mol]
-
-    if gas_composition_dict == None:
-        gas_composition_dict = { }
-        gas_composition_dict['N'] = 0.0
-        gas_composition_dict['O'] = 0.0
-        gas_composition_dict['NO'] = 0.0
-        gas_composition_dict['N2'] = 0.79
-        gas_composition_dict['O2'] = 0.21
-
-    tmp = 0
-    for i in gas_composition_dict.keys():
-        tmp += gas_composition_dict[i] * gladstone_const[i] 
-
-    return tmp 
-
-def Gladstone_Dale(gas_density_dict=None): # [kg/m3
-    gas_amu_weight   = aero.air_atomic_mass()       # [g/mol]
-    avogadro_number  = s_consts.N_A                 # [particles/mol]
-    dielectric_const = s_consts.epsilon_0           # [F/m]
-    gd_consts        = constants_tables.karl_2003() # [m3/kg]
-    pol_consts       = constants_tables.polarizability() #[m^3]
-
-    # Convert CGS to SI 
-    pol_consts.update({n: 4 * np.pi * dielectric_const * pol_consts[n]
-                       for n in pol_consts.keys()}) # [Fm^2]
-
-    # Calculate Gladstone dale
-    gladstone_dale_const = { }
-    for i in pol_consts:
-        gladstone_dale_const[i] = ( pol_consts[i] / (2 * dielectric_const) * 
-                (avogadro_number / gas_amu_weight[i]) * 1E3 ) #[m3/kg]
+    """Gladstone-Dale constant [m3/kg] at altitude [m] of the mole fractions
+    in gas_composition_dict (constants or a composition table, see
+    atmospheric_profile), defaults to AIR_COMPOSITION"""
+    profile = atmospheric_profile(altitude, gas_composition_dict)
+    return profile['gladstone_dale'] #[m3/kg]
+
+# Mole fractions of the homosphere, used when no composition is provided
+AIR_COMPOSITION = { 'N2' : 0.79,
+                    'O2' : 0.21 }
+
+def atmospheric_profile(altitude, composition_dict=None, density=None):
+    """Altitude resolved Gladstone-Dale constant and index of refraction.
+    composition_dict holds the mole fractions of every species, either
+    constants or arrays tabulated at composition_dict['altitude'] [m] (e.g.
+    with atomic O and N in the thermosphere), interpolated linearly and
+    normalized to 1. The Gladstone-Dale constant only depends on the mass
+    fractions, the index of refraction also needs density [kg/m3], which
+    defaults to atmospheric_properties (standard atmosphere, up to 81 km)
+    and is NaN outside of it unless provided. Returns mole_fraction and
+    mass_fraction ({species: [altitude]}) and density, gladstone_dale,
+    dilute and dense [altitude]"""
+    altitude = np.asarray(altitude, dtype=float)
+    composition_dict = dict(composition_dict or AIR_COMPOSITION)
+    altitude_table = composition_dict.pop('altitude', None)
+    species = tuple(composition_dict.keys())
+
+    # [species, altitude]
+    mole_fraction = np.empty((len(species),) + altitude.shape)
+    for i, val in enumerate(composition_dict.values()):
+        if altitude_table is None or np.ndim(val) == 0:
+            mole_fraction[i] = val
+        else:
+            mole_fraction[i] = np.interp(altitude, altitude_table, val)
+    mole_fraction /= np.sum(mole_fraction, axis=0)
+
+    # Y_i = X_i M_i / sum(X_j M_j), with M_i proportional to 1 / (N_i per kg)
+    number_density = molar_number_density(species) #[particles/kg]
+    mass_fraction = mole_fraction / number_density.reshape(
+                                    (-1,) + (1,) * altitude.ndim)
+    mass_fraction /= np.sum(mass_fraction, axis=0)
+
+    gd_consts = gladstone_dale_coefficients(species) #[m3/kg]
+    gladstone_dale = np.sum(mass_fraction * gd_consts.reshape(
+                                (-1,) + (1,) * altitude.ndim), axis=0)
+
+    if density is None:
+        inside = ((altitude >= ambiance.CONST.h_min) &
+                  (altitude <= ambiance.CONST.h_max))
+        density = np.where(inside, atmospheric_properties(
+                                np.where(inside, altitude, 0.0))['density'],
+                           np.nan) #[kg/m3]
+    density = np.broadcast_to(np.asarray(density, dtype=float),
+                              altitude.shape)
+    # n - 1 = GD rho
+    refractivity = gladstone_dale * density
+
+    dict_out = { }
+    dict_out['mole_fraction'] = dict(zip(species, mole_fraction))
+    dict_out['mass_fraction'] = dict(zip(species, mass_fraction))
+    dict_out['density'] = density
+    dict_out['gladstone_dale'] = gladstone_dale
+    dict_out['dilute'] = 1 + refractivity
+    dict_out['dense'] = _dense_index(refractivity * (2/3))
+    return dict_out
+
+# Mean radius of the Earth [m], the atmosphere is spherically stratified
+EARTH_RADIUS = 6371E3
+
+def slant_path(elevation_deg, observer_altitude=0.0, vaporPressure=0,
+               top_altitude=ATMOSPHERE_RANGE[1], apparent_flag=True,
+               tolerance=1E-6, shells=1, max_shells=256):
+    """Optical path through the standard atmosphere (atmospheric_properties)
+    from observer_altitude [m] up to top_altitude [m], for broadcast arrays
+    of elevation angles [deg] (0 to 90) and observer altitudes.
+    elevation_deg is the apparent elevation with apparent_flag, otherwise
+    the true (vacuum) elevation of a source above the atmosphere and the
+    apparent one is solved for, every output is NaN for the rays below the
+    horizon of the observer (the true elevation is below -bending at 0 deg)
+    and the ones that did not converge. Every ray is integrated with Gauss-Legendre
+    over 1 km altitude shells, split in two (up to max_shells pieces) until
+    the OPL, its excess and the bending change less than tolerance
+    (relative). Near the horizon the accuracy is bounded by the tolerance of
+    atmospheric_table.
+    Returns opl [m], excess (OPL - geometric length) [m], geometric_length
+    [m], bending [deg], apparent_elevation [deg], true_elevation [deg] and
+    error (relative change of the last refinement)"""
+    (elevation_deg,
+     observer_altitude) = np.broadcast_arrays(
+                            np.asarray(elevation_deg, dtype=float),
+                            np.asarray(observer_altitude, dtype=float))
+    if np.any(elevation_deg > 90) or (apparent_flag and
+                                      np.any(elevation_deg < 0)):
+        raise ValueError('The apparent elevation has to be between 0 and '
+                         '90 deg')
+    if np.any(observer_altitude >= top_altitude):
+        raise ValueError('observer_altitude has to be below top_altitude')
+
+    true_elevation = np.radians(elevation_deg.ravel())
+    altitude = observer_altitude.ravel()
+    integrate = lambda elevation, altitude: _slant_path_adaptive(elevation,
+                                        altitude, vaporPressure, top_altitude,
+                                        tolerance, shells, max_shells)
+    dict_out = integrate(np.clip(true_elevation, 0, np.pi / 2), altitude)
+    if not apparent_flag:
+        # Fixed point of apparent = true + bending(apparent), the bending
+        # changes slowly with the elevation and only the rays that did not
+        # converge are integrated again
+        active = np.arange(true_elevation.size)
+        for _ in range(50):
+            apparent_elevation = np.clip(true_elevation[active] +
+                                         dict_out['bending'][active],
+                                         0, np.pi / 2)
+            change = np.abs(apparent_elevation -
+                            dict_out['apparent_elevation'][active])
+            converged = change <= tolerance * dict_out['bending'][active]
+            (active, apparent_elevation) = (active[~converged],
+                                            apparent_elevation[~converged])
+            if not active.size:
+                break
+            tmp = integrate(apparent_elevation, altitude[active])
+            for key, val in tmp.items():
+                dict_out[key][active] = val
+
+        # Sources below -bending at 0 deg never reach the observer, their
+        # apparent elevation was clipped to 0
+        missed = (true_elevation < dict_out['apparent_elevation'] -
+                  dict_out['bending'] * (1 + tolerance))
+        missed[active] = True
+        for val in dict_out.values():
+            val[missed] = np.nan
+
+    dict_out['true_elevation'] = (dict_out['apparent_elevation'] -
+                                  dict_out['bending'])
+    for key in ('bending', 'apparent_elevation', 'true_elevation'):
+        dict_out[key] = np.degrees(dict_out[key])
+    return {key: val.reshape(elevation_deg.shape)
+            for key, val in dict_out.items()}
+
+def _slant_path_adaptive(elevation, altitude, vaporPressure, top_altitude,
+                         tolerance, shells, max_shells):
+    # The altitude shells are the 1 km geopotential intervals atmospheric_table
+    # starts from, the temperature kinks fall on their boundaries. Only the
+    # rays that did not converge are refined by splitting the shells
+    geopotential_altitude = np.linspace(*GEOPOTENTIAL_RANGE,
+                                        int(GEOPOTENTIAL_RANGE[1] / 1E3) + 1)
+    boundaries = np.reshape(ambiance.Atmosphere.geop2geom_height(
+                                geopotential_altitude), -1) #[m]
+    boundaries = np.append(boundaries[boundaries < top_altitude],
+                           top_altitude)
+    dict_out = _slant_path_shells(elevation, altitude, vaporPressure,
+                                  boundaries, shells)
+    dict_out['error'] = np.full(elevation.size, np.inf)
+    active = np.arange(elevation.size)
+    while active.size and shells < max_shells:
+        shells *= 2
+        tmp = _slant_path_shells(elevation[active], altitude[active],
+                                 vaporPressure, boundaries, shells)
+        error = np.zeros(active.size)
+        for key in ('opl', 'excess', 'bending'):
+            change = np.abs(tmp[key] - dict_out[key][active])
+            # Straight up there is no bending at all
+            error = np.maximum(error, np.divide(change, np.abs(tmp[key]),
+                                                out=change.copy(),
+                                                where=tmp[key] != 0))
+        for key, val in tmp.items():
+            dict_out[key][active] = val
+        dict_out['error'][active] = error
+        active = active[error > tolerance]
+    return dict_out
+
+# Gauss-Legendre nodes and weights of every altitude shell
+_GAUSS_NODES = np.polynomial.legendre.leggauss(8)
+
+def _slant_path_shells(elevation, altitude, vaporPressure, boundaries,
+                       shells, max_nodes=2**22):
+    # Bouguer invariant n r cos(elevation) = a along the ray. With
+    # r = r_0 + t^2 the ds = n r dr / sqrt(n^2 r^2 - a^2) singularity of
+    # horizontal rays goes away. Every altitude shell is split in shells
+    # intervals of t, shells below the observer have no width
+    (nodes, weights) = _GAUSS_NODES
+    dict_out = {key: np.empty(elevation.size) for key in
+                ('opl', 'excess', 'geometric_length', 'bending')}
+    dict_out['apparent_elevation'] = elevation.copy()
+    fraction = ((np.arange(shells)[:, np.newaxis] + 0.5 * (nodes + 1)) /
+                shells).ravel()
+    rays = max(1, max_nodes // (boundaries.size * fraction.size))
+    for start in range(0, elevation.size, rays):
+        stop = min(start + rays, elevation.size)
+        elevation_0 = elevation[start:stop, np.newaxis]
+        altitude_0 = altitude[start:stop, np.newaxis] #[m]
+        radius_0 = EARTH_RADIUS + altitude_0 #[m]
+        refractivity_0 = atmospheric_properties(altitude_0,
+                                                vaporPressure)['refractivity']
+        # [rays, shells], and the top of the atmosphere
+        t_boundaries = np.sqrt(np.maximum(boundaries - altitude_0, 0))
+        width = np.diff(t_boundaries, axis=1)[..., np.newaxis]
+        t = (t_boundaries[:, :-1, np.newaxis] + width * fraction).reshape(
+                                                        stop - start, -1)
+        dt = (width * np.tile(weights, shells) / (2 * shells)).reshape(
+                                                        stop - start, -1)
+        t = np.append(t, t_boundaries[:, -1:], axis=1)
+        radius = radius_0 + t**2
+        refractivity = atmospheric_properties(radius - EARTH_RADIUS,
+                                              vaporPressure)['refractivity']
+        n_r = (1 + refractivity) * radius
+        invariant = (1 + refractivity_0) * radius_0 * np.cos(elevation_0)
+        # n r - a without cancellation for nearly horizontal rays
+        difference = ((refractivity - refractivity_0) * radius +
+                      (1 + refractivity_0) * (t**2 + 2 * radius_0 *
+                                              np.sin(0.5 * elevation_0)**2))
+        # Rounding makes it slightly negative at the observer of horizontal rays
+        root = np.sqrt(np.maximum(difference * (n_r + invariant), 0))
+        jacobian = np.divide(2 * t[:, :-1] * dt, root[:, :-1],
+                             out=np.zeros_like(dt), where=dt > 0)
+
+        length = np.sum(n_r[:, :-1] * jacobian, axis=1)
+        excess = np.sum(refractivity[:, :-1] * n_r[:, :-1] * jacobian, axis=1)
+        # Central angle, the ray turns by less than a straight line would
+        central_angle = np.sum(invariant / radius[:, :-1] * jacobian, axis=1)
+        elevation_top = np.arctan2(root[:, -1], invariant[:, 0])
+        dict_out['geometric_length'][start:stop] = length
+        dict_out['excess'][start:stop] = excess
+        dict_out['opl'][start:stop] = length + excess
+        dict_out['bending'][start:stop] = (elevation_0[:, 0] + central_angle -
+                                           elevation_top)
+    return dict_out
+
+def Gladstone_Dale(gas_density_dict=None, dtype=None): # [kg/m3
+    # Calculate Gladstone dale of every species with a polarizability
+    species = tuple(i for i in constants_tables.SPECIES
+                    if constants_tables.has_constants(i, 'polarizability'))
+    gladstone_dale_const = dict(zip(species,
+                                    gladstone_dale_coefficients(species)))
 
-    gladstone_dale_dict = { }
     if not gas_density_dict:
         return gladstone_dale_const #[m^3/kg]
     else:
-        gladstone_dale_dict['gladstone_dale'] = 0.0
-        for i in gas_density_dict:
-            gladstone_dale_dict[i] = ((gladstone_dale_const[i] *
-                                       gas_density_dict[i]) /
-                                      sum(gas_density_dict.values()))
-            gladstone_dale_dict['gladstone_dale'] += gladstone_dale_const[i] * gas_density_dict[i]
-        gladstone_dale_dict['gladstone_dale'] /= sum(gas_density_dict.values())
-
+        (gladstone_dale_dict, _, _) = optical_properties(gas_density_dict,
+                                                         dtype)
         return gladstone_dale_dict #[m3/kg]
 
+def optical_properties(gas_density_dict, dtype=None, jacobian_flag=False):
+    """Dictionary version of optical_properties_matrix, returns
+    (gladstone_dale_dict, mass_fraction_dict, n_return), and jacobian_dict
+    ({'gladstone_dale', 'dilute', 'dense'}: {species: derivative}) with
+    jacobian_flag"""
+    species = tuple(gas_density_dict.keys())
+    properties = optical_properties_matrix(
+                        species_density_matrix(gas_density_dict, species,
+                                               dtype or float),
+                        species, jacobian_flag)
+    if jacobian_flag:
+        jacobian_dict = {k: dict(zip(species, properties[f'jacobian_{k}']))
+                         for k in ('gladstone_dale', 'dilute', 'dense')}
+        return (*_optical_properties_dicts(properties, species),
+                jacobian_dict)
+    return _optical_properties_dicts(properties, species)
+
+def temperature_optical_properties(gas_density_dict, temperature_K,
+                                   vibrational_temperature_K=None,
+                                   model='buldakov', **kargs):
+    """Dictionary version of temperature_optical_properties_matrix, returns
+    (gladstone_dale_dict, mass_fraction_dict, n_return)"""
+    species = tuple(gas_density_dict.keys())
+    properties = temperature_optical_properties_matrix(
+                        species_density_matrix(gas_density_dict, species),
+                        species, temperature_K, vibrational_temperature_K,
+                        model, **kargs)
+    return _optical_properties_dicts(properties, species)
+
+def _optical_properties_dicts(properties, species):
+    gladstone_dale_dict = { }
+    gladstone_dale_dict['gladstone_dale'] = properties['gladstone_dale']
+    gladstone_dale_dict.update(zip(species, properties['gladstone_species']))
+    mass_fraction_dict = dict(zip(species, properties['mass_fraction']))
+    n_return = { }
+    n_return['dilute'] = properties['dilute']
+    n_return['dense'] = properties['dense']
+    return gladstone_dale_dict, mass_fraction_dict, n_return
+
+def optical_properties_matrix(density_matrix, species, jacobian_flag=False):
+    """Fused Gladstone-Dale, mass fraction and index of refraction kernel for
+    a [species, cells] matrix of mass densities [kg/m^3]. The total density
+    is computed once and every output is derived from it, returns the species
+    Gladstone-Dale contributions and mass fractions [species, cells] and the
+    mixture Gladstone-Dale, dilute and dense index [cells]. jacobian_flag
+    also returns their analytic derivatives with respect to every species
+    density, 'jacobian_gladstone_dale', 'jacobian_dilute' and
+    'jacobian_dense' [species, cells]"""
+    gd_consts = gladstone_dale_coefficients(tuple(species)) #[m3/kg]
+    gd_consts = gd_consts.reshape((-1,) + (1,) * (np.ndim(density_matrix) - 1))
+    # Reduced precision density matrices keep their precision
+    gd_consts = gd_consts.astype(np.result_type(density_matrix, np.float16))
+    return _optical_properties(density_matrix, gd_consts, jacobian_flag)
+
+def temperature_optical_properties_matrix(density_matrix, species,
+                                          temperature_K,
+                                          vibrational_temperature_K=None,
+                                          model='buldakov',
+                                          jacobian_flag=False, **kargs):
+    """optical_properties_matrix with per-cell Gladstone-Dale constants from
+    the temperature dependent polarizability_field (kargs are passed to it),
+    temperature_K (and vibrational_temperature_K) are [cells] fields. The
+    jacobian is taken at fixed temperature"""
+    polarizability = polarizability_field(species, temperature_K,
+                                          vibrational_temperature_K, model,
+                                          **kargs) #[m^3]
+    # GD_i = 4 pi e_0 a_i N_i / (2 e_0) per kg
+    number_density = molar_number_density(tuple(species)) #[particles/kg]
+    gd_consts = polarizability * (2 * np.pi * number_density.reshape(
+                        (-1,) + (1,) * (polarizability.ndim - 1))) #[m3/kg]
+    return _optical_properties(density_matrix, gd_consts, jacobian_flag)
+
+def _optical_properties(density_matrix, gd_consts, jacobian_flag=False):
+    dict_out = { }
+    total_density = np.sum(density_matrix, axis=0)
+    dict_out['mass_fraction'] = density_matrix / total_density
+    # Species contributions and mixture, GD_i Y_i and sum(GD_i Y_i)
+    dict_out['gladstone_species'] = dict_out['mass_fraction'] * gd_consts
+    dict_out['gladstone_dale'] = np.sum(dict_out['gladstone_species'], axis=0)
+    if jacobian_flag:
+        # d(GD)/d(rho_j) = (GD_j - GD) / rho, d(n_dilute)/d(rho_j) = GD_j
+        dict_out['jacobian_gladstone_dale'] = ((gd_consts -
+                                                dict_out['gladstone_dale']) /
+                                               total_density)
+        dict_out['jacobian_dilute'] = np.broadcast_to(gd_consts,
+                                            np.shape(density_matrix)).copy()
+
+    # n - 1 = sum(GD_i rho_i) = sum(a_i N_i) / (2 e_0), reuses total_density.
+    # Reduced precision n - 1 is accurate, but the index is formed in at
+    # least float64 since adding 1 in float32 would lose most of it
+    refractivity = total_density
+    refractivity *= dict_out['gladstone_dale']
+    refractivity = refractivity.astype(np.result_type(refractivity, float),
+                                       copy=False)
+    dict_out['dense'] = _dense_index(refractivity * (2/3))
+    if jacobian_flag:
+        # n_dense^2 = (1 + 2x) / (1 - x) with x = 2/3 (n - 1), so
+        # d(n_dense)/d(rho_j) = GD_j / (n_dense (1 - x)^2)
+        dict_out['jacobian_dense'] = (dict_out['jacobian_dilute'] /
+                                      (dict_out['dense'] *
+                                       (1 - refractivity * (2/3))**2))
+    refractivity += 1
+    dict_out['dilute'] = refractivity
+    return dict_out
+
+def load_density_fields(input_paths, dtype=np.float32, shape=None):
+    """Memory-maps the species density fields [kg/m^3] of input_paths
+    (species: path), .npy files keep their own dtype and shape, raw binary
+    files are read as dtype with the given shape"""
+    density_fields = { }
+    for species, path in input_paths.items():
+        if path.endswith('.npy'):
+            density_fields[species] = np.load(path, mmap_mode='r')
+        else:
+            density_fields[species] = np.memmap(path, dtype=dtype, mode='r',
+                                                shape=shape)
+    return density_fields
+
+def optical_properties_chunked(density_fields, output_path,
+                               chunk_size=2**20):
+    """Out-of-core optical_properties_matrix. density_fields (species: array,
+    e.g. from load_density_fields) are streamed in chunks of chunk_size cells
+    and every output is written to a memory-mapped .npy file in output_path,
+    so peak memory is bounded by chunk_size. Results are bit-identical to the
+    in-memory path, returns the memory-mapped outputs"""
+    species = tuple(density_fields.keys())
+    field_shape = np.shape(density_fields[species[0]])
+    flat_fields = {i: np.reshape(density_fields[i], -1) for i in species}
+    cells = flat_fields[species[0]].size
+
+    # Output files [cells] and [species, cells]
+    os.makedirs(output_path, exist_ok=True)
+    dict_out = { }
+    flat_out = { }
+    for key in ('gladstone_dale', 'dilute', 'dense',
+                'mass_fraction', 'gladstone_species'):
+        out_shape = field_shape
+        if key in ('mass_fraction', 'gladstone_species'):
+            out_shape = (len(species),) + field_shape
+        dict_out[key] = np.lib.format.open_memmap(
+                                os.path.join(output_path, f'{key}.npy'),
+                                mode='w+', dtype=float, shape=out_shape)
+        flat_out[key] = dict_out[key].reshape(out_shape[:-len(field_shape)] +
+                                              (cells,))
+
+    for start in range(0, cells, chunk_size):
+        stop = min(start + chunk_size, cells)
+        density_matrix = species_density_matrix(
+                            {i: flat_fields[i][start:stop] for i in species},
+                            species)
+        chunk_out = optical_properties_matrix(density_matrix, species)
+        for key, val in chunk_out.items():
+            flat_out[key][..., start:stop] = val
+
+    for val in dict_out.values():
+        val.flush()
+    return dict_out
+
+def dispersive_index_of_refraction_matrix(density_matrix, species,
+                                         wavelength_nm):
+    """Dilute and dense index of refraction [wavelength, cells] of a
+    [species, cells] matrix of mass densities [kg/m^3] over a band of
+    wavelengths [nm], using the frequency dependent polarizabilities
+    a_i(lambda) = a_i dispersion_factors. All wavelengths come from a single
+    matrix product with the densities"""
+    dielectric_const_0 = s_consts.epsilon_0 # [F/m]
+    species = tuple(species)
+    # [wavelength, species] [F m^2/kg]
+    coefficients = (dispersion_factors(species,
+                                       tuple(np.ravel(wavelength_nm))) *
+                    refractivity_coefficients(species))
+    temp = np.tensordot(coefficients, density_matrix, axes=1) # sum(a_i N_i)
+
+    n_return = { }
+    n_return['dilute'] = 1 + temp / (2 * dielectric_const_0)
+    n_return['dense']  = _dense_index(temp / (3 * dielectric_const_0))
+    return n_return
+
+def dispersive_index_of_refraction_chunked(density_fields, wavelength_nm,
+                                           output_path=None,
+                                           chunk_size=2**18):
+    """Streams density_fields (species: array) in chunks of chunk_size cells
+    through dispersive_index_of_refraction_matrix, every density is read
+    once for the whole band. Outputs are [wavelength, field shape], written
+    to memory-mapped .npy files in output_path when provided"""
+    species = tuple(density_fields.keys())
+    wavelength_nm = np.ravel(wavelength_nm)
+    field_shape = np.shape(density_fields[species[0]])
+    flat_fields = {i: np.reshape(density_fields[i], -1) for i in species}
+    cells = flat_fields[species[0]].size
+    out_shape = (len(wavelength_nm),) + field_shape
+
+    if output_path:
+        os.makedirs(output_path, exist_ok=True)
+    dict_out = { }
+    flat_out = { }
+    for key in ('dilute', 'dense'):
+        if output_path:
+            dict_out[key] = np.lib.format.open_memmap(
+                                os.path.join(output_path,
+                                             f'dispersive_{key}.npy'),
+                                mode='w+', dtype=float, shape=out_shape)
+        else:
+            dict_out[key] = np.empty(out_shape)
+        flat_out[key] = dict_out[key].reshape(len(wavelength_nm), cells)
+
+    for start in range(0, cells, chunk_size):
+        stop = min(start + chunk_size, cells)
+        density_matrix = species_density_matrix(
+                            {i: flat_fields[i][start:stop] for i in species},
+                            species)
+        chunk_out = dispersive_index_of_refraction_matrix(density_matrix,
+                                                          species,
+                                                          wavelength_nm)
+        for key, val in chunk_out.items():
+            flat_out[key][:, start:stop] = val
+
+    if output_path:
+        for val in dict_out.values():
+            val.flush()
+    return dict_out
+
+def refractivity_field(temperature_K, pressure_Pa, vapor_pressure_Pa=0,
+                       K_1=REFRACTIVITY_K1, K_2=REFRACTIVITY_K2,
+                       output_path=None, dtype=float, chunk_size=2**20,
+                       workers=None):
+    """Refractivity (n - 1) of moist air on a grid (e.g. weather model or CFD
+    output), same formula as atmospheric_index_of_refraction. temperature_K,
+    pressure_Pa, vapor_pressure_Pa and the K_1 [K/mbar], K_2 [K] coefficients
+    are broadcast to one field shape. The field is computed in blocks of at
+    most chunk_size cells by workers threads, so peak memory is bounded by
+    workers * chunk_size. The output is written to a
+    memory-mapped refractivity.npy in output_path when provided"""
+    arrays = [np.asarray(i) for i in (temperature_K, pressure_Pa,
+                                      vapor_pressure_Pa, K_1, K_2)]
+    field_shape = np.broadcast_shapes(*[i.shape for i in arrays])
+    # Broadcast views, nothing is copied until a slab is read
+    view_shape = field_shape or (1,)
+    arrays = [np.broadcast_to(i, view_shape) for i in arrays]
+
+    if output_path:
+        os.makedirs(output_path, exist_ok=True)
+        refractivity = np.lib.format.open_memmap(
+                            os.path.join(output_path, 'refractivity.npy'),
+                            mode='w+', dtype=dtype, shape=field_shape)
+    else:
+        refractivity = np.empty(field_shape, dtype=dtype)
+    flat_out = refractivity.reshape(view_shape)
+
+    # NumPy releases the GIL in the arithmetic, so the blocks run in parallel
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        list(executor.map(lambda block: _refractivity(
+                                *[i[block] for i in arrays], flat_out[block]),
+                          _field_blocks(view_shape, chunk_size)))
+
+    if output_path:
+        refractivity.flush()
+    return refractivity
+
+def _field_blocks(shape, chunk_size):
+    # Basic slices of at most chunk_size cells covering shape, whole trailing
+    # axes are kept together while they fit and the next axis is split
+    axis = len(shape) - 1
+    trailing = 1
+    while axis > 0 and trailing * shape[axis] <= chunk_size:
+        trailing *= shape[axis]
+        axis -= 1
+    rows = max(1, chunk_size // trailing)
+    for outer in np.ndindex(*shape[:axis]):
+        for start in range(0, shape[axis], rows):
+            yield outer + (slice(start, start + rows),)
+
+def _refractivity(temperature, pressure, vapor_pressure, K_1, K_2, out):
+    # K_1 / T (p + K_2 e / T) 1E-6 with the pressures in Pa, evaluated in out
+    # with a single float64 temporary
+    tmp = np.divide(K_2, temperature, dtype=float)
+    tmp *= vapor_pressure
+    tmp += pressure
+    tmp *= K_1
+    tmp /= temperature
+    np.multiply(tmp, 1E-8, out=out)
+
+def _dense_index(n_temp):
+    """Dense (Lorentz-Lorenz) index from n_temp = sum(a_i N_i) / (3 e_0)"""
+    return ( (2 * n_temp + 1) / (1 - n_temp) )**0.5
+
+def _dense_refractivity(n_temp):
+    """Dense (Lorentz-Lorenz) n - 1 from n_temp = sum(a_i N_i) / (3 e_0)"""
+    return np.expm1(0.5 * (np.log1p(2 * n_temp) - np.log1p(-n_temp)))
+
+@functools.lru_cache(maxsize=None)
+def gladstone_dale_coefficients(species):
+    """Gladstone-Dale constant [m3/kg] of every species (tuple), same values
+    as Gladstone_Dale()"""
+    coefficients = (refractivity_coefficients(species) /
+                    (2 * s_consts.epsilon_0))
+    coefficients.flags.writeable = False
+    return coefficients #[m3/kg]
+
 
 if __name__ == "__main__":
     gd = Gladstone_Dale()
@@ -33,12 +33,10 @@ import constants_tables as s_consts
 def kerl_analysis(temperature_K, wavelength_nm, fig_config): 
     # Calculations #
     keys = ['N2', 'O2', 'Air']
-    dict_kerl = { }
-    for k in keys:
-        dict_kerl[k] = np.zeros(np.shape(temperature_K)[0])
-        for i, val in enumerate(temperature_K):
-            dict_kerl[k][i] = optics.kerl_polarizability_temperature(val, k,
-                                                                wavelength_nm)
+    # [molecule, wavelength, temperature]
+    kerl = optics.kerl_polarizability_tensor(temperature_K, keys,
+                                             wavelength_nm)
+    dict_kerl = {k: kerl[i, 0] for i, k in enumerate(keys)}
     # Calculations #
 
     # Plot #
@@ -65,29 +63,20 @@ def kerl_analysis(temperature_K, wavelength_nm, fig_config):
 def buldakov_analysis(temperature_K, vibrational_number_max,
                       rotational_number_max, molecule):
     # [vibrational, rotational]
-    buldakov_expansion = np.zeros([vibrational_number_max + 1,
-                                   rotational_number_max + 1])
+    buldakov_expansion = optics.buldakov_expansion(
+                    np.arange(vibrational_number_max + 1)[:, np.newaxis],
+                    np.arange(rotational_number_max + 1)[np.newaxis, :],
+                    molecule)
 
     # [temperature, vibrational, rotational]
-    distribution_func = np.zeros([np.shape(temperature_K)[0],
-                                  vibrational_number_max + 1,
-                                  rotational_number_max + 1])
-
-    for j in range(rotational_number_max + 1):
-        for v in range(vibrational_number_max + 1):
-            buldakov_expansion[v][j] = optics.buldakov_expansion(v, j, molecule)
-
-    for ti, val in enumerate(temperature_K):
-        distribution_func[ti] = quantum.distribution_function(val, molecule,
+    distribution_func = quantum.distribution_function(temperature_K, molecule,
                                 vibrational_number_max,
                                 rotational_number_max,
-                                born_opp_flag=True) 
+                                born_opp_flag=True)
 
     # Sum for all states
-    buldakov_polarizability = np.zeros(np.shape(temperature_K)[0])
-    for ti, val in enumerate(temperature_K): 
-        buldakov_polarizability[ti] = np.sum(distribution_func[ti,:,:] *
-                                             buldakov_expansion)
+    buldakov_polarizability = quantum.thermal_average(distribution_func,
+                                                      buldakov_expansion)
 
 
     IPython.embed(colors = 'Linux')
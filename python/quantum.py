@@ -8,20 +8,31 @@
     ----------------------------------------------------
     Martin E. Liza  10/29/2024  Initial version.
 '''
-import os 
-import sys 
-import IPython
-import molmass
+import functools
 import constants_tables 
+import table_cache
+import jit_kernels
 import numpy as np
 import scipy.constants as s_consts 
+from scipy.special import logsumexp
+from lazy_imports import lazy_import
+
+# Imported on first use
+IPython = lazy_import('IPython')
+molmass = lazy_import('molmass')
 
 # My Packages 
-scripts_path   = os.environ.get('SCRIPTS')
-python_scripts = os.path.join(scripts_path, 'Python')
-sys.path.append(python_scripts) 
-import helper_functions as helper 
-import aerodynamic_functions as aero
+helper = lazy_import('helper_functions', scripts_flag=True)
+aero = lazy_import('aerodynamic_functions', scripts_flag=True)
+
+# Upper limit for adaptive sums over harmonic levels
+MAX_QUANTUM_NUMBER = 4096
+
+def _registry(molecule, *keys):
+    # Constants registry and species ID of molecule (name or ID), raises a
+    # KeyError when one of the constants in keys is not defined for it
+    constants_tables.require_constants(molecule, *keys)
+    return (constants_tables.REGISTRY, constants_tables.species_id(molecule))
 
 # Unit Conversions
 def wavenumber_to_electronvolt(wavenumber_cm):
@@ -39,59 +50,401 @@ def molarmass_to_kilogram(molarmass_gmol):
 def zero_point_energy(molecule):
     """Calculate zero-point energy based on spectroscopy constants. 
     (Ref: Irikura https://doi.org/10.1063/1.2436891)"""
-    spectroscopy_const = constants_tables.spectroscopy_constants(molecule)
-    scope_var = (spectroscopy_const['alpha_e'] *
-                 spectroscopy_const['omega_e'] /
-                 spectroscopy_const['B_e'])
-    zpe = spectroscopy_const['omega_e'] / 2
-    zpe -= spectroscopy_const['omega_xe'] / 2
-    zpe += spectroscopy_const['omega_ye'] / 8
-    zpe += spectroscopy_const['B_e'] / 4
+    (spectroscopy_const, index) = _registry(molecule, 'omega_e', 'omega_xe',
+                                            'omega_ye', 'B_e', 'alpha_e')
+    scope_var = (spectroscopy_const['alpha_e'][index] *
+                 spectroscopy_const['omega_e'][index] /
+                 spectroscopy_const['B_e'][index])
+    zpe = spectroscopy_const['omega_e'][index] / 2
+    zpe -= spectroscopy_const['omega_xe'][index] / 2
+    zpe += spectroscopy_const['omega_ye'][index] / 8
+    zpe += spectroscopy_const['B_e'][index] / 4
     zpe += scope_var / 12 
-    zpe += scope_var**2 / (144 * spectroscopy_const['B_e'])
+    zpe += scope_var**2 / (144 * spectroscopy_const['B_e'][index])
     return zpe #[1/cm] 
 
-def vibrational_partition_function(vibrational_number, temperature_K, molecule):
-    """Calculates the vibrational partition function, (harmonic terms only)"""
-    z_vib = 0.0
-    for v in range(vibrational_number + 1):
-        z_vib += boltzman_factor(temperature_K, molecule, vibrational_number=v)
-    return z_vib
-
-def rotational_partition_function(rotational_number, temperature_K, molecule):
-    """Calculates the rotational partition function, (harmonic terms only)"""
-    z_rot = 0.0
-    for j in range(rotational_number + 1):
-        z_rot += boltzman_factor(temperature_K, molecule, rotational_number=j)
-    return z_rot
+def vibrational_partition_function(vibrational_number, temperature_K, molecule,
+                                   tolerance=None, log_flag=False):
+    """Calculates the vibrational partition function, (harmonic terms only).
+    temperature_K can be an array, the output has the same shape. If a
+    relative tolerance is provided, levels are added until the remaining
+    Boltzman tail falls below it (vibrational_number is then an upper limit
+    and can be None), and (z_vib, truncation_number) is returned. The sum is
+    evaluated with log-sum-exp, log_flag returns ln(z_vib)"""
+    temperature = np.ravel(temperature_K)
+    log_term_function = lambda index, first, last: boltzman_factor_grid(
+                            temperature[index],
+                            energy_table(last, 0,
+                                         molecule)['vibrational'][first:],
+                            log_flag=True)
+    if tolerance is not None:
+        number_max = (MAX_QUANTUM_NUMBER if vibrational_number is None
+                      else vibrational_number)
+        (log_z, truncation_number) = adaptive_state_sum(log_term_function,
+                                                        np.shape(temperature_K),
+                                                        tolerance, number_max)
+        return _log_output(log_z, log_flag), truncation_number
+
+    log_z = logsumexp(boltzman_factor_grid(temperature_K,
+                        energy_table(vibrational_number, 0,
+                                     molecule)['vibrational'],
+                        log_flag=True), axis=-1)
+    return _log_output(log_z, log_flag)
+
+def rotational_partition_function(rotational_number, temperature_K, molecule,
+                                  tolerance=None, log_flag=False):
+    """Calculates the rotational partition function, (harmonic terms only).
+    temperature_K can be an array, the output has the same shape. If a
+    relative tolerance is provided, levels are added until the remaining
+    Boltzman tail falls below it (rotational_number is then an upper limit
+    and can be None), and (z_rot, truncation_number) is returned. The sum is
+    evaluated with log-sum-exp, log_flag returns ln(z_rot)"""
+    def log_term_function(index, first, last):
+        table = energy_table(0, last, molecule)
+        return boltzman_factor_grid(temperature[index],
+                                    table['rotational'][first:],
+                                    table['degeneracy'][first:], log_flag=True)
+    temperature = np.ravel(temperature_K)
+    if tolerance is not None:
+        number_max = (MAX_QUANTUM_NUMBER if rotational_number is None
+                      else rotational_number)
+        (log_z, truncation_number) = adaptive_state_sum(log_term_function,
+                                                        np.shape(temperature_K),
+                                                        tolerance, number_max)
+        return _log_output(log_z, log_flag), truncation_number
+
+    table = energy_table(0, rotational_number, molecule)
+    log_z = logsumexp(boltzman_factor_grid(temperature_K, table['rotational'],
+                                           table['degeneracy'], log_flag=True),
+                      axis=-1)
+    return _log_output(log_z, log_flag)
 
 def born_oppenheimer_partition_function(vibrational_number,
                                         rotational_number,
                                         temperature_K,
-                                        molecule):
+                                        molecule,
+                                        tolerance=None,
+                                        log_flag=False):
     """Calculates the partition function using the Born-Oppenheimer
-    approximation"""
-    z_bo = 0.0
-    for j in range(rotational_number + 1):
-        for v in range(vibrational_number + 1):
-            z_bo += boltzman_factor(temperature_K, molecule,
-                                    vibrational_number=v,
-                                    rotational_number=j,
-                                    born_opp_flag=True)
-    return z_bo
+    approximation. temperature_K can be an array, the output has the same
+    shape. If a relative tolerance is provided, the rotational and then the
+    vibrational levels are truncated once their Boltzman tails fall below
+    tolerance / 2 each, vibrational_number and rotational_number are upper
+    limits (None uses the bound state limits) and
+    (z_bo, (vib_truncation, rot_truncation)) is returned. The sum is
+    evaluated with log-sum-exp, log_flag returns ln(z_bo)"""
+    if tolerance is not None:
+        (log_z, truncation_number) = _adaptive_born_oppenheimer(
+                                          vibrational_number,
+                                          rotational_number, temperature_K,
+                                          molecule, tolerance)
+        return _log_output(log_z, log_flag), truncation_number
+
+    table = energy_table(vibrational_number, rotational_number, molecule)
+    log_factor = boltzman_factor_grid(temperature_K,
+                                      table['born_oppenheimer'],
+                                      table['degeneracy'], log_flag=True)
+    log_z = logsumexp(log_factor, axis=(-2, -1))
+    return _log_output(log_z, log_flag)
+
+def cumulative_partition_function(vibrational_number, rotational_number,
+                                  temperature_K, molecule, born_opp_flag=True,
+                                  log_flag=False):
+    """Prefix sums of the Boltzman factors over v and J, entry [..., v, J] is
+    the partition function truncated at (v, J), so a convergence study over
+    every truncation comes from one array. temperature_K can be an array,
+    the output has shape (temperature_K.shape + [v, J])"""
+    table = energy_table(vibrational_number, rotational_number, molecule)
+    if born_opp_flag:
+        log_factor = boltzman_factor_grid(temperature_K,
+                                          table['born_oppenheimer'],
+                                          table['degeneracy'], log_flag=True)
+    else:
+        log_vib = boltzman_factor_grid(temperature_K, table['vibrational'],
+                                       log_flag=True)
+        log_rot = boltzman_factor_grid(temperature_K, table['rotational'],
+                                       table['degeneracy'], log_flag=True)
+        log_factor = (log_vib[..., :, np.newaxis] +
+                      log_rot[..., np.newaxis, :])
+
+    # Scale by the largest factor before exponentiating (log-sum-exp)
+    log_max = np.max(log_factor, axis=(-2, -1), keepdims=True)
+    z_cum = np.cumsum(np.cumsum(np.exp(log_factor - log_max), axis=-2),
+                      axis=-1)
+    if log_flag:
+        return np.log(z_cum) + log_max
+    return z_cum * np.exp(log_max)
+
+def tabulated_partition_function(vibrational_number, rotational_number,
+                                 temperature_K, molecule, born_opp_flag=True,
+                                 temperature_range=(100, 20000),
+                                 tolerance=1E-6, log_flag=False,
+                                 cache_path=None):
+    """Partition function interpolated from a log-spaced temperature table of
+    ln(z), built on first use per (molecule, vibrational_number,
+    rotational_number) and kept by table_cache (LRU, optionally on disk).
+    The relative error of z is below tolerance inside temperature_range,
+    temperatures outside it are evaluated directly"""
+    def log_partition_function(temperature):
+        if born_opp_flag:
+            return born_oppenheimer_partition_function(vibrational_number,
+                                                       rotational_number,
+                                                       temperature, molecule,
+                                                       log_flag=True)
+        return (vibrational_partition_function(vibrational_number,
+                                               temperature, molecule,
+                                               log_flag=True) +
+                rotational_partition_function(rotational_number,
+                                              temperature, molecule,
+                                              log_flag=True))
+
+    builder = lambda: table_cache.build_table(
+                        lambda x: {'log_z': log_partition_function(x)},
+                        *temperature_range, tolerance=tolerance,
+                        relative_flag=False)
+    key = ('partition_function', molecule, vibrational_number,
+           rotational_number, born_opp_flag, *temperature_range, tolerance)
+    table = table_cache.cached_table(key, builder, cache_path)
+
+    temperature_K = np.asarray(temperature_K, dtype=float)
+    log_z = table_cache.interpolate_table(table, temperature_K)['log_z']
+    outside = ((temperature_K < temperature_range[0]) |
+               (temperature_K > temperature_range[1]))
+    if np.any(outside):
+        # Only the temperatures outside the table are summed directly
+        (log_z, outside) = (np.array(log_z, ndmin=1), np.atleast_1d(outside))
+        log_z[outside] = log_partition_function(
+                            np.atleast_1d(temperature_K)[outside])
+        log_z = log_z.reshape(temperature_K.shape)
+    return _log_output(log_z, log_flag)
+
+def _log_output(log_value, log_flag):
+    """Returns log_value or exp(log_value)"""
+    return log_value if log_flag else np.exp(log_value)
+
+def _adaptive_born_oppenheimer(vibrational_number, rotational_number,
+                               temperature_K, molecule, tolerance):
+    """Adaptive truncation of born_oppenheimer_partition_function, only bound
+    states (see bound_state_limits) are added. The vibrational cutoff of each
+    temperature is estimated first from the J = 0 levels, the rotational
+    truncation sums the vibrational levels below it and the vibrational
+    truncation the retained rotational levels. Returns
+    (ln(z_bo), (vib_truncation, rot_truncation))"""
+    (vib_limit, rot_limit) = bound_state_limits(molecule)
+    if vibrational_number is not None:
+        vib_limit = min(vibrational_number, vib_limit)
+    if rotational_number is not None:
+        rot_limit = min(rotational_number, rot_limit)
+
+    temperature = np.ravel(temperature_K)
+    shape = np.shape(temperature_K)
+    table = energy_table(vib_limit, rot_limit, molecule)
+    # Energies above the ground state, every Boltzman factor is at most its
+    # degeneracy and the inner sums are done without logarithms
+    ground_energy = table['born_oppenheimer'][0, 0]
+    energy = table['born_oppenheimer'] - ground_energy
+    bound_mask = bound_state_mask(vib_limit, rot_limit, molecule)
+    def bound_factor(index, vib_levels, rot_levels):
+        # [index, v, J] of the bound states, 0 elsewhere
+        factor = boltzman_factor_grid(temperature[index],
+                                      energy[vib_levels, rot_levels],
+                                      table['degeneracy'][rot_levels])
+        return factor * bound_mask[vib_levels, rot_levels]
+
+    # Vibrational cutoff estimate from the J = 0 levels
+    log_ground_terms = lambda index, first, last: boltzman_factor_grid(
+                            temperature[index], energy[first:last + 1, 0],
+                            log_flag=True)
+    (_, vib_estimate) = adaptive_state_sum(log_ground_terms, shape,
+                                           tolerance / 2, vib_limit)
+    vib_estimate = np.ravel(vib_estimate)
+
+    # Rotational truncation summing the vibrational levels below the cutoff
+    def log_rot_terms(index, first, last):
+        def log_terms(index, vib_max):
+            vib_mask = (np.arange(vib_max + 1) <=
+                        vib_estimate[index, np.newaxis])[..., np.newaxis]
+            factor = bound_factor(index, slice(0, vib_max + 1),
+                                  slice(first, last + 1))
+            return np.log(np.sum(factor * vib_mask, axis=-2))
+        return _grouped_terms(index, vib_estimate, log_terms)
+
+    # Vibrational truncation summing the retained rotational levels, its sum
+    # is the partition function
+    def log_vib_terms(index, first, last):
+        def log_terms(index, rot_max):
+            rot_mask = (np.arange(rot_max + 1) <=
+                        rot_flat[index, np.newaxis])[:, np.newaxis, :]
+            factor = bound_factor(index, slice(first, last + 1),
+                                  slice(0, rot_max + 1))
+            return np.log(np.sum(factor * rot_mask, axis=-1))
+        return _grouped_terms(index, rot_flat, log_terms)
+
+    with np.errstate(divide='ignore'):
+        (_, rot_truncation) = adaptive_state_sum(log_rot_terms, shape,
+                                                 tolerance / 2, rot_limit)
+        rot_flat = np.ravel(rot_truncation)
+        (log_z, vib_truncation) = adaptive_state_sum(log_vib_terms, shape,
+                                        tolerance / 2, vib_limit,
+                                        number_start=int(np.max(vib_estimate,
+                                                                initial=1)))
+    log_z += boltzman_factor_grid(temperature_K, ground_energy, log_flag=True)
+    return log_z, (vib_truncation, rot_truncation)
+
+def _grouped_terms(index, limit, log_terms):
+    """Evaluates log_terms(index, level_max) on groups of the cells index
+    with limits (limit[index]) below the same power of two, so every group
+    only sums the levels up to its own largest limit"""
+    group = np.ceil(np.log2(limit[index] + 1)).astype(int)
+    out = None
+    for val in np.unique(group):
+        rows = group == val
+        tmp = log_terms(index[rows], int(np.max(limit[index[rows]])))
+        if out is None:
+            out = np.empty((index.size, tmp.shape[-1]))
+        out[rows] = tmp
+    return out
+
+def adaptive_state_sum(log_term_function, shape, tolerance, number_max,
+                       number_start=16):
+    """Sums the Boltzman terms of the levels 0, 1, ... of every cell of an
+    array of shape, log_term_function(index, first, last) returns the
+    logarithms of the terms of levels first to last [index.size, levels] of
+    the flat cells index. The levels are doubled (up to number_max) until the
+    tail beyond them, estimated as a geometric series from the last two
+    terms, is below tolerance times the sum. Each doubling only evaluates the
+    new levels of the cells that did not converge. The terms are scaled by
+    the largest term of the first block to avoid underflow. Returns
+    (ln(sum), truncation_number) of shape, where truncation_number is the
+    first level of each cell whose remaining tail is below tolerance"""
+    cells = int(np.prod(shape, dtype=int))
+    log_sum = np.empty(cells)
+    truncation_number = np.empty(cells, dtype=int)
+
+    number = max(1, min(number_start, number_max))
+    active = np.arange(cells)
+    log_terms = log_term_function(active, 0, number)
+    log_shift = np.max(log_terms, axis=-1, keepdims=True)
+    terms = np.exp(log_terms - log_shift)
+    while active.size:
+        partial = np.cumsum(terms, axis=-1)
+        total = partial[:, -1]
+
+        # Geometric estimate of the levels beyond number, none are added
+        # past number_max
+        last = terms[:, -1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = last / terms[:, -2]
+            beyond = np.where(ratio < 1, last * ratio / (1 - ratio), np.inf)
+        beyond = np.where((last == 0) | (number >= number_max), 0.0, beyond)
+        converged = beyond <= tolerance * total
+
+        # Remaining tail after each level of the converged cells
+        tail = (total[converged, np.newaxis] - partial[converged] +
+                beyond[converged, np.newaxis])
+        index = np.argmax(tail <= tolerance * total[converged, np.newaxis],
+                          axis=-1)
+        truncation_number[active[converged]] = index
+        log_sum[active[converged]] = (np.log(np.take_along_axis(
+                                        partial[converged],
+                                        index[:, np.newaxis], axis=-1)[:, 0]) +
+                                      log_shift[converged, 0])
+
+        (active, terms, log_shift) = (active[~converged], terms[~converged],
+                                      log_shift[~converged])
+        if active.size:
+            first = number + 1
+            number = min(2 * number, number_max)
+            log_terms = log_term_function(active, first, number)
+            terms = np.concatenate([terms, np.exp(log_terms - log_shift)],
+                                   axis=-1)
+    return log_sum.reshape(shape)[()], truncation_number.reshape(shape)[()]
+
+def bound_state_limits(molecule):
+    """Calculates the largest vibrational number (dE/dv = 0 at J = 0) and
+    rotational number (dE/dJ = 0 at v = 0) before the Born-Oppenheimer
+    energy turns over, levels above them are not physical"""
+    (spectroscopy_const, index) = _registry(molecule, 'omega_e', 'omega_xe',
+                                            'B_e', 'D_e')
+    vib_limit = (spectroscopy_const['omega_e'][index] /
+                 (2 * spectroscopy_const['omega_xe'][index]) - 1/2)
+    rot_levels = (spectroscopy_const['B_e'][index] /
+                  (2 * spectroscopy_const['D_e'][index]))
+    rot_limit = (np.sqrt(1 + 4 * rot_levels) - 1) / 2
+    return (int(vib_limit), int(rot_limit))
+
+def bound_state_mask(vibrational_number, rotational_number, molecule):
+    """Boolean [v, J] mask of the states below the rotational turn over of
+    each vibrational level, dE/dJ = B_e - alpha_e (v + 1/2) - 2 D_e J(J + 1)
+    has to be positive"""
+    (spectroscopy_const, index) = _registry(molecule, 'B_e', 'D_e',
+                                            'alpha_e')
+    vib_levels = np.arange(vibrational_number + 1) + 1/2
+    rot_levels = np.arange(rotational_number + 1)
+    rot_levels = rot_levels * (rot_levels + 1)
+    rotational_constant = (spectroscopy_const['B_e'][index] -
+                           spectroscopy_const['alpha_e'][index] * vib_levels)
+    return (2 * spectroscopy_const['D_e'][index] * rot_levels[np.newaxis, :] <
+            rotational_constant[:, np.newaxis])
+
+@functools.lru_cache(maxsize=None)
+def energy_table(vibrational_number, rotational_number, molecule):
+    """Precomputes the energy [J] of every (v, J) state up to
+    vibrational_number and rotational_number. The table is built once per
+    (vibrational_number, rotational_number, molecule) and its arrays are
+    read-only."""
+    vib_number = np.arange(vibrational_number + 1)
+    rot_number = np.arange(rotational_number + 1)
+    vib_mesh, rot_mesh = np.meshgrid(vib_number, rot_number, indexing='ij')
+
+    table = { }
+    # Harmonic terms only [v], [J]
+    table['vibrational'] = wavenumber_to_joules(
+                            vibrational_energy_k(vib_number, molecule)) #[J]
+    table['rotational'] = wavenumber_to_joules(
+                            rotational_energy_k(rot_number, molecule)) #[J]
+    # Born-Oppenheimer [v, J]
+    table['born_oppenheimer'] = wavenumber_to_joules(
+                    born_oppenheimer_approximation(vib_mesh, rot_mesh,
+                                                   molecule)) #[J]
+    table['degeneracy'] = 2 * rot_number + 1
+
+    for val in table.values():
+        val.flags.writeable = False
+    return table
+
+def boltzman_factor_grid(temperature_K, energy_J, degeneracy=1,
+                         log_flag=False, backend=None):
+    """Vectorized Boltzman factor, broadcasts an array of temperatures against
+    an array of energy levels [J]. The output has shape
+    (temperature_K.shape + energy_J.shape), log_flag returns
+    ln(degeneracy) - E/kT which does not underflow. backend selects the
+    'numpy' or compiled 'numba' kernel (see jit_kernels)"""
+    temperature_K = np.asarray(temperature_K, dtype=float)
+    thermal_beta = 1 / (s_consts.k * temperature_K)
+    if jit_kernels.get_backend(backend) == 'numba':
+        return jit_kernels.boltzman_factor_grid(thermal_beta, energy_J,
+                                                degeneracy, log_flag)
+    thermal_beta = np.reshape(thermal_beta,
+                              thermal_beta.shape + (1,) * np.ndim(energy_J))
+    log_factor = np.log(degeneracy) - energy_J * thermal_beta
+    return _log_output(log_factor, log_flag)
 
 
 def potential_dunham_coef_012(molecule):
     """Calculates the 0th, 1st, and 2nd Dunham potential coefficients.
     Using: Ogilvie (https://doi.org/10.1016/0022-2852(76)90323-4)
     and Herschbach (https://doi.org/10.1063/1.1731952)."""
-    spectroscopy_const = constants_tables.spectroscopy_constants(molecule)
-    a_0 = (spectroscopy_const['omega_e']**2 /
-           (4 * spectroscopy_const['B_e']))
-    a_1 = -(spectroscopy_const['alpha_e'] * spectroscopy_const['omega_e'] /
-               (6 * spectroscopy_const['B_e']**2) + 1)
+    (spectroscopy_const, index) = _registry(molecule, 'omega_e', 'omega_xe',
+                                            'B_e', 'alpha_e')
+    a_0 = (spectroscopy_const['omega_e'][index]**2 /
+           (4 * spectroscopy_const['B_e'][index]))
+    a_1 = -(spectroscopy_const['alpha_e'][index] *
+            spectroscopy_const['omega_e'][index] /
+               (6 * spectroscopy_const['B_e'][index]**2) + 1)
     a_2 = ((5/4) * a_1**2 - (2/3) *
-           (spectroscopy_const['omega_xe'] / spectroscopy_const['B_e'])) 
+           (spectroscopy_const['omega_xe'][index] /
+            spectroscopy_const['B_e'][index])) 
     return (a_0, a_1, a_2)
 
 def potential_dunham_coeff_m(a_1, a_2, m):
@@ -133,86 +486,168 @@ def boltzman_factor(temperature_K, molecule, vibrational_number=None, rotational
 
 
 def distribution_function(temperature_K, molecule, vibrational_number=None,
-                    rotational_number=None, born_opp_flag=False):
-    """Compute the population distribution function."""
-    # Calculates partition functions if vibrational or rotational numbers are provided
-    if not born_opp_flag:
-        z_rot = 1
-        z_vib = 1
-        if vibrational_number is not None:
-            z_vib = vibrational_partition_function(vibrational_number, temperature_K,
-                                          molecule)
-        if rotational_number is not None:
-            z_rot = rotational_partition_function(rotational_number, temperature_K,
-                                         molecule)
-        z_tot = z_rot * z_vib
+                    rotational_number=None, born_opp_flag=False,
+                    log_flag=False):
+    """Compute the population distribution function. temperature_K can be an
+    array, the output has shape (temperature_K.shape + [v, J]), dropping the
+    state axis that is not provided. For a temperature sweep this is the full
+    [temperature, v, J] population tensor, see thermal_average. Populations
+    are normalized in log space (log-sum-exp), log_flag returns their
+    logarithm"""
+    table = energy_table(vibrational_number or 0, rotational_number or 0,
+                         molecule)
+
+    # Logarithm of the Boltzman factors of every state
+    if born_opp_flag:
+        log_factor = boltzman_factor_grid(temperature_K,
+                                          table['born_oppenheimer'],
+                                          table['degeneracy'], log_flag=True)
+        state_axes = (-2, -1)
+    elif vibrational_number is not None and rotational_number is not None:
+        log_vib = boltzman_factor_grid(temperature_K, table['vibrational'],
+                                       log_flag=True)
+        log_rot = boltzman_factor_grid(temperature_K, table['rotational'],
+                                       table['degeneracy'], log_flag=True)
+        log_factor = (log_vib[..., :, np.newaxis] +
+                      log_rot[..., np.newaxis, :])
+        state_axes = (-2, -1)
+    elif vibrational_number is not None:
+        log_factor = boltzman_factor_grid(temperature_K, table['vibrational'],
+                                          log_flag=True)
+        state_axes = -1
     else:
-        z_tot = born_oppenheimer_partition_function(vibrational_number,
-                                       rotational_number, temperature_K,
-                                       molecule)
-
-    # Create the distribution array based on the inputs provided
-    if vibrational_number and rotational_number:
-        tmp = np.zeros([vibrational_number + 1, rotational_number + 1])
-        for j in range(rotational_number + 1):
-            for v in range(vibrational_number + 1):
-                tmp[v][j] = boltzman_factor(temperature_K=temperature_K,
-                                            molecule=molecule,
-                                            vibrational_number=v,
-                                            rotational_number=j,
-                                            born_opp_flag=born_opp_flag)
-    elif vibrational_number:
-        tmp = np.zeros(vibrational_number + 1)
-        for v in range(vibrational_number + 1):
-            tmp[v] = boltzman_factor(temperature_K=temperature_K,
-                                        molecule=molecule,
-                                        vibrational_number=v)
-
-    elif rotational_number:
-        tmp = np.zeros(rotational_number + 1)
-        for j in range(rotational_number + 1):
-            tmp[j] = boltzman_factor(temperature_K=temperature_K,
-                                        molecule=molecule,
-                                        rotational_number=j)
-    return tmp / z_tot
+        log_factor = boltzman_factor_grid(temperature_K, table['rotational'],
+                                          table['degeneracy'], log_flag=True)
+        state_axes = -1
+
+    # The partition function is the sum over all states, the factors are
+    # scaled by the largest one before exponentiating (log-sum-exp)
+    log_max = np.max(log_factor, axis=state_axes, keepdims=True)
+    factor = np.exp(log_factor - log_max)
+    z_tot = np.sum(factor, axis=state_axes, keepdims=True)
+    if log_flag:
+        return log_factor - log_max - np.log(z_tot)
+    return factor / z_tot
+
+def two_temperature_distribution_function(translational_temperature_K,
+                                          vibrational_temperature_K, molecule,
+                                          vibrational_number,
+                                          rotational_number,
+                                          born_opp_flag=True,
+                                          log_flag=False):
+    """Compute the nonequilibrium population distribution function, the
+    vibrational levels are populated at vibrational_temperature_K (Tv) and the
+    rotational levels at translational_temperature_K (Tt). Both temperatures
+    can be arrays (e.g. the Tt and Tv columns of a heat bath), the output has
+    shape (broadcast(Tt, Tv).shape + [v, J])"""
+    log_factor = _two_temperature_log_factor(translational_temperature_K,
+                                             vibrational_temperature_K,
+                                             molecule, vibrational_number,
+                                             rotational_number, born_opp_flag)
+
+    # Scale by the largest factor before exponentiating (log-sum-exp)
+    log_max = np.max(log_factor, axis=(-2, -1), keepdims=True)
+    factor = np.exp(log_factor - log_max)
+    z_tot = np.sum(factor, axis=(-2, -1), keepdims=True)
+    if log_flag:
+        return log_factor - log_max - np.log(z_tot)
+    return factor / z_tot
+
+def two_temperature_partition_function(vibrational_number, rotational_number,
+                                       translational_temperature_K,
+                                       vibrational_temperature_K, molecule,
+                                       born_opp_flag=True, log_flag=False):
+    """Calculates the two-temperature partition function, vibrational levels
+    at vibrational_temperature_K (Tv) and rotational levels at
+    translational_temperature_K (Tt). The output has the broadcast shape of
+    the temperatures, log_flag returns ln(z)"""
+    log_factor = _two_temperature_log_factor(translational_temperature_K,
+                                             vibrational_temperature_K,
+                                             molecule, vibrational_number,
+                                             rotational_number, born_opp_flag)
+    return _log_output(logsumexp(log_factor, axis=(-2, -1)), log_flag)
+
+def _two_temperature_log_factor(translational_temperature_K,
+                                vibrational_temperature_K, molecule,
+                                vibrational_number, rotational_number,
+                                born_opp_flag):
+    """Logarithm of the two-temperature Boltzman factors [..., v, J]. With
+    born_opp_flag the vibrational energy is E(v, 0) and the rotational energy
+    is E(v, J) - E(v, 0), otherwise the harmonic terms are used"""
+    (temperature_t, temperature_v) = np.broadcast_arrays(
+                                        np.asarray(translational_temperature_K,
+                                                   dtype=float),
+                                        np.asarray(vibrational_temperature_K,
+                                                   dtype=float))
+    table = energy_table(vibrational_number, rotational_number, molecule)
+
+    if born_opp_flag:
+        energy_vib = table['born_oppenheimer'][:, :1]                 #[J]
+        energy_rot = table['born_oppenheimer'] - energy_vib           #[J]
+        log_vib = boltzman_factor_grid(temperature_v, energy_vib,
+                                       log_flag=True)
+        log_rot = boltzman_factor_grid(temperature_t, energy_rot,
+                                       table['degeneracy'], log_flag=True)
+        return log_vib + log_rot
+
+    log_vib = boltzman_factor_grid(temperature_v, table['vibrational'],
+                                   log_flag=True)
+    log_rot = boltzman_factor_grid(temperature_t, table['rotational'],
+                                   table['degeneracy'], log_flag=True)
+    return log_vib[..., :, np.newaxis] + log_rot[..., np.newaxis, :]
+
+def thermal_average(distribution, state_property):
+    """Thermally averages a (v, J)-indexed property using a population
+    distribution from distribution_function. The trailing state axes of
+    distribution are contracted against state_property in one reduction, the
+    output has the shape of the leading (temperature) axes."""
+    state_property = np.asarray(state_property)
+    return np.tensordot(distribution, state_property,
+                        axes=state_property.ndim)
 
 def born_oppenheimer_approximation(vibrational_number, rotational_number,
-                                   molecule):
+                                   molecule, backend=None):
     """Calculates the energy at a rotational and vibrational quantum number,
     using the Born-Oppenheimer approximation."""
-    spectroscopy_constants = constants_tables.spectroscopy_constants(molecule)
+    (spectroscopy_constants, index) = _registry(molecule, 'omega_e',
+                                                'omega_xe', 'B_e', 'D_e',
+                                                'alpha_e')
+    if jit_kernels.get_backend(backend) == 'numba':
+        return jit_kernels.born_oppenheimer_approximation(
+                    vibrational_number, rotational_number, index) #[cm^1]
 
     vib_levels = vibrational_number + 1/2
     rot_levels = rotational_number * (rotational_number + 1)
 
     # Harmonic vibration and rotation terms
-    harmonic = spectroscopy_constants['omega_e'] * vib_levels
-    harmonic += spectroscopy_constants['B_e'] * rot_levels
+    harmonic = spectroscopy_constants['omega_e'][index] * vib_levels
+    harmonic += spectroscopy_constants['B_e'][index] * rot_levels
 
     # Anharmonic vibration and rotation terms 
-    anharmonic = spectroscopy_constants['omega_xe'] * vib_levels**2
-    anharmonic += spectroscopy_constants['D_e'] * rot_levels**2
+    anharmonic = spectroscopy_constants['omega_xe'][index] * vib_levels**2
+    anharmonic += spectroscopy_constants['D_e'][index] * rot_levels**2
 
     # Interaction between vibration and rotation modes
-    interaction = spectroscopy_constants['alpha_e'] * vib_levels * rot_levels
+    interaction = (spectroscopy_constants['alpha_e'][index] * vib_levels *
+                   rot_levels)
 
     return harmonic - anharmonic - interaction #[cm^1]
 
 def vibrational_energy_k(vibrational_number, molecule):
     """Calculates the vibrational energy at a given vibrational quantum number,
     using for the harmonic terms"""
-    spectroscopy_constants = constants_tables.spectroscopy_constants(molecule)
+    (spectroscopy_constants, index) = _registry(molecule, 'omega_e')
     # Calculates the vibrational energy in units of wave number
     vib_levels = vibrational_number + 1/2
-    return spectroscopy_constants['omega_e'] * vib_levels #[cm^-1]
+    return spectroscopy_constants['omega_e'][index] * vib_levels #[cm^-1]
 
 def rotational_energy_k(rotational_number, molecule):
     """Calculates the rotational energy at a given rotational quantum number,
     using for the harmonic terms"""
-    spectroscopy_constants = constants_tables.spectroscopy_constants(molecule)
+    (spectroscopy_constants, index) = _registry(molecule, 'B_e')
     # Calculates the rotational energy in units of wave number
     rot_levels = rotational_number * (rotational_number + 1)
-    return spectroscopy_constants['B_e'] * rot_levels #[cm^-1]
+    return spectroscopy_constants['B_e'][index] * rot_levels #[cm^-1]
 
 def reduced_mass_kg(molecule_1, molecule_2):
     """Calculates the molar reduced mass and returns it in kg of two
@@ -0,0 +1,147 @@
+'''
+    Date:   10/18/2026
+    Author: Martin E. Liza
+    File:   table_cache.py
+    Def:    Tabulated functions of one variable (temperature, altitude)
+            with vectorized interpolation, LRU eviction and optional on-disk
+            persistence.
+
+    Author          Date        Revision
+    ----------------------------------------------------
+    Martin E. Liza  10/18/2026  Initial version.
+'''
+import os
+import warnings
+import collections
+import numpy as np
+
+# Number of tables kept in memory, the least recently used one is evicted
+MAX_TABLES = 32
+# Directory used to persist tables when no cache_path is provided
+CACHE_PATH = os.environ.get('AEROOPTICS_CACHE')
+
+_tables = collections.OrderedDict()
+
+def build_table(function, x_min, x_max, tolerance=1E-6, log_flag=True,
+                relative_flag=True, points=65, max_points=2**16 + 1):
+    """Tabulates function(x), which returns a dictionary of arrays shaped like
+    x, on a uniform grid in log(x) (log_flag) or x. The number of intervals is
+    doubled until linear interpolation, checked at the midpoint of every
+    interval, is within tolerance (relative to the value with
+    relative_flag). A RuntimeWarning is issued when max_points is reached
+    before the tolerance, the error reached is kept in table['error']"""
+    while True:
+        x = _grid(x_min, x_max, points, log_flag)
+        columns = function(x)
+        x_mid = _grid(x_min, x_max, 2 * points - 1, log_flag)[1::2]
+        exact = function(x_mid)
+
+        error = 0.0
+        for key, val in columns.items():
+            interpolated = 0.5 * (val[:-1] + val[1:])
+            tmp = np.abs(interpolated - exact[key])
+            if relative_flag:
+                tmp = tmp / np.abs(exact[key])
+            error = max(error, np.max(tmp))
+
+        if error <= tolerance:
+            break
+        if points >= max_points:
+            warnings.warn(f'Table stopped at {points} points with error '
+                          f'{error:.3g} above tolerance {tolerance:.3g}',
+                          RuntimeWarning)
+            break
+        points = 2 * points - 1
+
+    table = { }
+    table['x'] = x
+    table['columns'] = columns
+    table['log_flag'] = log_flag
+    table['error'] = error
+    return table
+
+def interpolate_table(table, x, function=None):
+    """Vectorized linear interpolation of every column of a table from
+    build_table, values outside the table are clipped to its ends or, when
+    the tabulated function is provided, evaluated with it"""
+    x_grid = table['x']
+    x = np.asarray(x, dtype=float)
+    outside = (x < x_grid[0]) | (x > x_grid[-1])
+    x_table = x
+    if table['log_flag']:
+        x_grid = np.log(x_grid)
+        x_table = np.log(x)
+
+    # Uniform grid, the interval is found without searching
+    step = (x_grid[-1] - x_grid[0]) / (len(x_grid) - 1)
+    position = np.clip((x_table - x_grid[0]) / step, 0, len(x_grid) - 1)
+    index = np.minimum(position.astype(int), len(x_grid) - 2)
+    weight = position - index
+
+    dict_out = { }
+    for key, val in table['columns'].items():
+        dict_out[key] = val[index] * (1 - weight) + val[index + 1] * weight
+
+    if function is not None and np.any(outside):
+        outside = np.atleast_1d(outside)
+        exact = function(np.atleast_1d(x)[outside])
+        for key, val in dict_out.items():
+            val = np.array(val, ndmin=1)
+            val[outside] = exact[key]
+            dict_out[key] = val.reshape(x.shape)
+    return dict_out
+
+def cached_table(key, builder, cache_path=None):
+    """Returns the table stored under key (a tuple). Tables are looked up in
+    memory, then in cache_path (or CACHE_PATH) as .npz files, and are only
+    built with builder() when missing. A table found in memory is also
+    written to cache_path when its file is missing"""
+    cache_path = cache_path or CACHE_PATH
+    file_path = None
+    if cache_path:
+        file_name = '_'.join(str(k) for k in key).replace(os.sep, '-')
+        file_path = os.path.join(cache_path, f'{file_name}.npz')
+
+    if key in _tables:
+        _tables.move_to_end(key)
+        table = _tables[key]
+        if file_path and not os.path.exists(file_path):
+            _save_table(table, file_path)
+        return table
+
+    if file_path and os.path.exists(file_path):
+        table = _load_table(file_path)
+    else:
+        table = builder()
+        if file_path:
+            _save_table(table, file_path)
+
+    _tables[key] = table
+    if len(_tables) > MAX_TABLES:
+        _tables.popitem(last=False)
+    return table
+
+def clear_tables():
+    """Removes every table kept in memory"""
+    _tables.clear()
+
+def _grid(x_min, x_max, points, log_flag):
+    if log_flag:
+        return np.exp(np.linspace(np.log(x_min), np.log(x_max), points))
+    return np.linspace(x_min, x_max, points)
+
+def _save_table(table, file_path):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    columns = {f'column_{k}': v for k, v in table['columns'].items()}
+    np.savez(file_path, x=table['x'], log_flag=table['log_flag'],
+             error=table['error'], **columns)
+
+def _load_table(file_path):
+    table = { }
+    with np.load(file_path) as data:
+        table['x'] = data['x']
+        table['log_flag'] = bool(data['log_flag'])
+        table['error'] = float(data['error'])
+        table['columns'] = {k[len('column_'):]: data[k] for k in data.files
+                            if k.startswith('column_')}
+    return table
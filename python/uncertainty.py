@@ -0,0 +1,179 @@
+'''
+    Date:   10/18/2026
+    Author: Martin E. Liza
+    File:   uncertainty.py
+    Def:    Monte Carlo propagation of the uncertainty of the polarizability
+            constants (constants_tables) to the Gladstone-Dale constant and
+            index of refraction. Every sample is evaluated at once as a
+            [samples, cells] output, streaming over cells.
+
+    Author          Date        Revision
+    ----------------------------------------------------
+    Martin E. Liza  10/18/2026  Initial version.
+'''
+import os
+import numpy as np
+import constants_tables
+import optics
+
+# Relative standard deviation of the sampled constants, the Buldakov
+# derivatives without a reference and the Kerl fit coefficients are the
+# least certain. Constants not listed are kept at their nominal value
+UNCERTAINTY = { 'polarizability'            : 0.01,
+                'polarizability_zeroth'     : 0.01,
+                'polarizability_first'      : 0.10,
+                'polarizability_second'     : 0.10,
+                'polarizability_third'      : 0.10,
+                'kerl_groundPolarizability' : 0.01,
+                'kerl_b'                    : 0.10,
+                'kerl_c'                    : 0.10 }
+
+MODELS = ('constant', 'kerl', 'buldakov')
+
+def sample_constants(samples, species, uncertainty=None, seed=None):
+    """Draws samples of every constant of constants_tables.REGISTRY for
+    species, normally distributed around the nominal value with the relative
+    standard deviation of uncertainty (defaults to UNCERTAINTY). Returns
+    {constant: [samples, species]}, the same seed gives the same samples"""
+    uncertainty = UNCERTAINTY if uncertainty is None else uncertainty
+    rng = np.random.default_rng(seed)
+    index = constants_tables.species_id(species)
+
+    dict_out = { }
+    # Every constant is drawn, so the samples of one constant do not depend
+    # on which other constants are perturbed
+    for key, val in constants_tables.REGISTRY.items():
+        noise = rng.standard_normal((samples, len(index)))
+        dict_out[key] = val[index] * (1 + uncertainty.get(key, 0.0) * noise)
+    return dict_out
+
+def ensemble_optical_properties(density_fields, samples, temperature_K=None,
+                                model='constant', uncertainty=None, seed=None,
+                                output_path=None, chunk_size=2**12,
+                                wavelength_nm=None, vibrational_number_max=5,
+                                rotational_number_max=30,
+                                temperature_range=(100, 20000),
+                                tolerance=1E-6, cache_path=None):
+    """Gladstone-Dale [m3/kg], dilute and dense index of refraction of
+    density_fields (species: array [kg/m^3]) for samples draws of the
+    constants (see sample_constants), outputs are [samples, field shape].
+    model is 'constant' (static polarizability), 'kerl' or 'buldakov' (both
+    need temperature_K). The polarizability of every model is linear in the
+    sampled constants, so all samples come from one matrix product per chunk
+    of chunk_size cells. Outputs are written to memory-mapped .npy files in
+    output_path when provided"""
+    if model not in MODELS:
+        raise ValueError(f'Unknown model {model}, use one of {MODELS}')
+    if model != 'constant' and temperature_K is None:
+        raise ValueError(f'The {model} model needs temperature_K')
+
+    species = tuple(density_fields.keys())
+    constants = sample_constants(samples, species, uncertainty, seed)
+    table_kargs = {'vibrational_number_max' : vibrational_number_max,
+                   'rotational_number_max'  : rotational_number_max,
+                   'temperature_range'      : temperature_range,
+                   'tolerance'              : tolerance,
+                   'cache_path'             : cache_path}
+    species_model = [_species_model(i, model) for i in species]
+    # [samples, features], n - 1 = weights @ features
+    weights = np.concatenate([_model_weights(constants, i, species_model[i])
+                              for i in range(len(species))], axis=1)
+    weights *= _feature_scale(species, species_model, wavelength_nm)
+
+    field_shape = np.shape(density_fields[species[0]])
+    flat_fields = {i: np.reshape(density_fields[i], -1) for i in species}
+    flat_temperature = None
+    if temperature_K is not None:
+        flat_temperature = np.reshape(np.broadcast_to(temperature_K,
+                                                      field_shape), -1)
+    cells = flat_fields[species[0]].size
+    out_shape = (samples,) + field_shape
+
+    if output_path:
+        os.makedirs(output_path, exist_ok=True)
+    dict_out = { }
+    flat_out = { }
+    for key in ('gladstone_dale', 'dilute', 'dense'):
+        if output_path:
+            dict_out[key] = np.lib.format.open_memmap(
+                                os.path.join(output_path,
+                                             f'ensemble_{key}.npy'),
+                                mode='w+', dtype=float, shape=out_shape)
+        else:
+            dict_out[key] = np.empty(out_shape)
+        flat_out[key] = dict_out[key].reshape(samples, cells)
+
+    for start in range(0, cells, chunk_size):
+        stop = min(start + chunk_size, cells)
+        density_matrix = optics.species_density_matrix(
+                            {i: flat_fields[i][start:stop] for i in species},
+                            species)
+        temperature = None
+        if flat_temperature is not None:
+            temperature = flat_temperature[start:stop]
+        # [features, cells]
+        features = np.concatenate([
+                        _model_features(molecule, species_model[i],
+                                        temperature, table_kargs) *
+                        density_matrix[i]
+                        for i, molecule in enumerate(species)])
+
+        refractivity = weights @ features               # sum(GD_i rho_i)
+        flat_out['gladstone_dale'][:, start:stop] = (refractivity /
+                                            np.sum(density_matrix, axis=0))
+        flat_out['dense'][:, start:stop] = optics._dense_index(
+                                                refractivity * (2/3))
+        flat_out['dilute'][:, start:stop] = 1 + refractivity
+
+    if output_path:
+        for val in dict_out.values():
+            val.flush()
+    return dict_out
+
+def _species_model(molecule, model):
+    # Species without the constants of model keep a static polarizability
+    if model == 'kerl' and constants_tables.has_constants(molecule, 'kerl_b'):
+        return 'kerl'
+    if (model == 'buldakov' and
+            constants_tables.has_constants(molecule, 'polarizability_first',
+                                           'omega_e')):
+        return 'buldakov'
+    return 'constant'
+
+def _model_weights(constants, index, model):
+    # Sampled constants multiplying each feature [samples, features]
+    if model == 'kerl':
+        ground = constants['kerl_groundPolarizability'][:, index]
+        return np.stack([ground, ground * constants['kerl_b'][:, index],
+                         ground * constants['kerl_c'][:, index]], axis=1)
+    if model == 'buldakov':
+        return np.stack([constants[f'polarizability_{k}'][:, index]
+                         for k in optics.BULDAKOV_DERIVATIVES], axis=1)
+    return constants['polarizability'][:, [index]]
+
+def _model_features(molecule, model, temperature, table_kargs):
+    # Temperature dependence of each feature [features, cells]
+    if model == 'kerl':
+        return np.stack([np.ones_like(temperature), temperature,
+                         temperature**2])
+    if model == 'buldakov':
+        return optics.buldakov_basis_temperature(temperature, molecule,
+                                                 **table_kargs).transpose()
+    return np.ones((1, 1))
+
+def _feature_scale(species, species_model, wavelength_nm):
+    # GD_i = 2 pi a_i N_i per kilogram, Kerl species are also dispersive
+    number_density = optics.molar_number_density(species) #[particles/kg]
+    dispersion = np.ones(len(species))
+    if wavelength_nm is not None:
+        dispersion = optics.dispersion_factors(species, (wavelength_nm,))[0]
+
+    scale = [ ]
+    for i, model in enumerate(species_model):
+        features = {'kerl': 3, 'buldakov': len(optics.BULDAKOV_DERIVATIVES),
+                    'constant': 1}[model]
+        factor = 2 * np.pi * number_density[i]
+        if model == 'kerl':
+            factor *= dispersion[i]
+        scale += [factor] * features
+    return np.array(scale)